@@ -1,4 +1,9 @@
-import os, re, csv, glob, argparse, warnings
+import os, sys, re, csv, glob, argparse, warnings, codecs, hashlib
+import time, shutil, threading, functools, itertools, multiprocessing
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
 from typing import List, Optional, Dict, Tuple
 from datetime import datetime
 import traceback
@@ -7,14 +12,18 @@ warnings.filterwarnings("ignore")
 
 import pandas as pd
 import numpy as np
+from pandas.api.types import union_categoricals
+from pandas.tseries.api import guess_datetime_format
 import dash
 from dash import dcc, html, Input, Output, State, MATCH, ALL
 import dash_bootstrap_components as dbc
 import plotly.express as px
 import plotly.graph_objs as go
 import plotly.io as pio
-import io, base64
+from plotly.utils import PlotlyJSONEncoder
+import io, gzip
 import boto3
+from botocore.config import Config as BotoConfig
 import json
 
 # ==============================
@@ -37,8 +46,16 @@ def _first_nonempty_series(sub: pd.DataFrame, candidates: list[str]) -> tuple[pd
     return pd.Series(dtype=str), None
 
 
+# Conta, por thread, as saídas provisórias (erro, serviço ocupado): memoize_figures não guarda o resultado
+# de um callback que montou alguma delas
+_NO_MEMOIZE = threading.local()
+
+def _skip_memoize() -> None:
+    _NO_MEMOIZE.count = getattr(_NO_MEMOIZE, "count", 0) + 1
+
 def _error_box(title: str, exc: Exception) -> html.Div:
     """Retorna um componente Dash exibindo o stack trace completo."""
+    _skip_memoize()
     return html.Div(
         [
             html.H4(title, className="mb-2 text-danger"),
@@ -71,20 +88,261 @@ df_main = pd.DataFrame()
 # 2) Setup e Constantes
 # ==============================
 try:
-    from wordcloud import WordCloud, STOPWORDS
+    import cpu_tasks  # nuvem de palavras (wordcloud + pillow), executável no pool de processos
     HAS_WORDCLOUD = True
 except ImportError:
+    cpu_tasks = None
     HAS_WORDCLOUD = False
-    STOPWORDS = set()
 
-# Cache para DataFrames carregados, chaveado por (ambiente, key)
-DF_CACHE: Dict[Tuple[str, str], pd.DataFrame] = {}
+try:
+    import fcntl  # lock entre processos (workers do gunicorn) no DATA_DIR
+except ImportError:
+    fcntl = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+    HAS_PARQUET = True
+except ImportError:
+    HAS_PARQUET = False
+
+try:
+    import zstandard  # CUBE publicado como .csv.zst
+    HAS_ZSTD = True
+except ImportError:
+    zstandard = None
+    HAS_ZSTD = False
+
+class LRUCache:
+    """Cache LRU limitado por bytes (medidos por `sizeof`), seguro entre threads.
+       Expõe contadores de hit/miss/eviction em `stats()`."""
+
+    def __init__(self, name: str, max_bytes: int, sizeof):
+        self.name = name
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._data: "OrderedDict" = OrderedDict()
+        self._sizes: Dict = {}
+        self._lock = threading.RLock()
+        self.nbytes = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, k, default=None):
+        with self._lock:
+            if k in self._data:
+                self._data.move_to_end(k)
+                self.hits += 1
+                return self._data[k]
+            self.misses += 1
+            return default
+
+    def peek(self, k, default=None):
+        """Lê sem afetar a ordem LRU nem os contadores."""
+        with self._lock:
+            return self._data.get(k, default)
+
+    def size_of(self, k) -> int:
+        """Bytes medidos na inserção de `k` (0 se não está no cache)."""
+        with self._lock:
+            return self._sizes.get(k, 0)
+
+    def __contains__(self, k) -> bool:
+        with self._lock:
+            return k in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __setitem__(self, k, v) -> None:
+        size = int(self._sizeof(v))
+        with self._lock:
+            self.pop(k)
+            self._data[k] = v
+            self._sizes[k] = size
+            self.nbytes += size
+            self._evict()
+
+    def _evict(self) -> None:
+        # nunca descarta o item mais recente (recém-inserido ou remedido), mesmo que sozinho estoure o orçamento
+        while self.nbytes > self.max_bytes and len(self._data) > 1:
+            old_k, _ = self._data.popitem(last=False)
+            self.nbytes -= self._sizes.pop(old_k)
+            self.evictions += 1
+            print(f"[CACHE] {self.name}: descartado {old_k} (LRU; uso={self.nbytes}/{self.max_bytes} bytes)")
+
+    def grow(self, v, delta: int) -> None:
+        """Soma `delta` bytes às entradas cujo valor é `v` (alterado depois de inserido) e aplica o orçamento."""
+        with self._lock:
+            for k in [k for k, cur in self._data.items() if cur is v]:
+                self._sizes[k] += delta
+                self.nbytes += delta
+                self._data.move_to_end(k)
+            self._evict()
+
+    def pop(self, k, default=None):
+        with self._lock:
+            if k not in self._data:
+                return default
+            self.nbytes -= self._sizes.pop(k)
+            return self._data.pop(k)
+
+    def keys(self) -> list:
+        with self._lock:
+            return list(self._data)
+
+    def pop_where(self, pred) -> int:
+        """Remove as entradas cuja chave satisfaz `pred`; devolve quantas saíram."""
+        with self._lock:
+            doomed = [k for k in self._data if pred(k)]
+            for k in doomed:
+                self.pop(k)
+            return len(doomed)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._data), "bytes": self.nbytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+class NegativeCache:
+    """Chaves cuja busca no S3 falhou (objeto inexistente), lembradas por `ttl` segundos junto com o motivo.
+       Evita repetir requisições que vão falhar sem impedir que um upload posterior apareça."""
+    def __init__(self, name: str, ttl: int):
+        self.name = name
+        self.ttl = ttl
+        self.hits = 0
+        self._data: Dict[object, Tuple[float, str]] = {}
+        self._lock = threading.Lock()
+
+    def _purge(self, now: float) -> None:
+        for k in [k for k, (expires, _) in self._data.items() if expires <= now]:
+            del self._data[k]
+
+    def get(self, k) -> Optional[str]:
+        """Motivo registrado para `k`, ou None se não há registro válido."""
+        with self._lock:
+            item = self._data.get(k)
+            if item is None:
+                return None
+            if item[0] <= time.time():
+                del self._data[k]
+                return None
+            self.hits += 1
+            return item[1]
+
+    def add(self, k, reason: str) -> None:
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            now = time.time()
+            self._purge(now)
+            self._data[k] = (now + self.ttl, reason)
+
+    def discard(self, k) -> None:
+        with self._lock:
+            self._data.pop(k, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._purge(time.time())
+            return {"entries": len(self._data), "hits": self.hits, "ttl_seconds": self.ttl}
+
+def _obj_nbytes(obj) -> int:
+    """Memória aproximada de índices/agregados/estado: arrays e objetos pandas pelo tamanho real, contêineres
+       somando o conteúdo."""
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(deep=True).sum())
+    if isinstance(obj, (pd.Series, pd.Index)):
+        return int(obj.memory_usage(deep=True))
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(_obj_nbytes(k) + _obj_nbytes(v) for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return sys.getsizeof(obj) + sum(_obj_nbytes(v) for v in obj)
+    return sys.getsizeof(obj)
+
+def _cube_nbytes(entry: dict) -> int:
+    """DF + tudo o que a entrada guarda (índices, qaggs e o que é anexado sob demanda: state, tokens, periods)."""
+    return int(entry["df"].memory_usage(deep=True).sum()) + sum(_obj_nbytes(v) for k, v in entry.items() if k != "df")
+
+def _cube_attach(cube: dict, name: str, value):
+    """Anexa um derivado calculado sob demanda à entrada do CUBE e atualiza o tamanho dela no DF_CACHE."""
+    delta = _obj_nbytes(value) - _obj_nbytes(cube.get(name))
+    cube[name] = value
+    DF_CACHE.grow(cube, delta)
+    return value
+
+# Cache para CUBEs carregados, chaveado por (ambiente, key), limitado pela memória real dos DataFrames.
+# Cada entrada: {"df": DataFrame, "etag": ETag do objeto no S3, "checked_at": epoch da última validação,
+#                "qindex": question_id -> posições (np.ndarray) das linhas da pergunta no df,
+#                "qaggs": question_id -> agregados sem filtro dos cards (ver question_aggregates),
+#                "dindex": "" (CUBE todo) / question_id -> (datas ordenadas, posições) p/ recortes de período,
+#                "periods": granularidade -> (código do período de cada linha, períodos) (sob demanda, ver period_codes),
+#                "tokens": índice de palavras da coluna answer (preenchido sob demanda por top_tokens),
+#                "sentiment": sentimento de cada linha como código inteiro (ver _build_sentiment_codes),
+#                "state": build_state do CUBE (preenchido sob demanda por cube_state),
+#                "version": número único por carga do CUBE (chave do FIGURE_CACHE)}
+DF_CACHE_MAX_BYTES = int(float(os.getenv("DF_CACHE_MAX_MB", "256")) * 1024 * 1024)
+DF_CACHE = LRUCache("DF_CACHE", DF_CACHE_MAX_BYTES, _cube_nbytes)
+_CUBE_VERSIONS = itertools.count(1)
+
+# Saídas já serializadas (JSON) dos callbacks de gráfico, chaveadas por
+# (env, key, versão do CUBE, marcador de metadados do questionário, callback, inputs); ver memoize_figures
+FIGURE_CACHE_MAX_BYTES = int(float(os.getenv("FIGURE_CACHE_MAX_MB", "64")) * 1024 * 1024)
+FIGURE_CACHE = LRUCache("FIGURE_CACHE", FIGURE_CACHE_MAX_BYTES, len)
+
+# Group-bys da pivot (uma linha por combinação de dimensões), chaveados por
+# (env, key, versão do CUBE, recorte, estatística, dimensões); ver pivot_table_cached
+PIVOT_CACHE_MAX_BYTES = int(float(os.getenv("PIVOT_CACHE_MAX_MB", "64")) * 1024 * 1024)
+PIVOT_CACHE = LRUCache("PIVOT_CACHE", PIVOT_CACHE_MAX_BYTES, lambda g: g.memory_usage(deep=True).sum())
+# Dimensões já agrupadas por chave do PIVOT_CACHE sem as dimensões: acha um group-by mais fino sem varrer o cache.
+# Pode apontar para entradas já descartadas pelo LRU (limpas na próxima consulta)
+_PIVOT_DIMS: Dict[tuple, set] = {}
+_PIVOT_DIMS_LOCK = threading.Lock()
+
+# Revalidação do CUBE em segundo plano a cada DF_CACHE_TTL_SECONDS: compara o ETag da variante publicada
+# (list_objects_v2 ou HEAD, ver _s3_find_cube) com o da entrada e só baixa se mudou; 0 desliga
+DF_CACHE_TTL_SECONDS = int(os.getenv("DF_CACHE_TTL_SECONDS", "300"))
+_REFRESH_LOCK = threading.Lock()
+_REFRESHING: set = set()
+
+# Cache negativo: CUBE/questionário inexistente no S3 não é consultado de novo por N segundos; 0 desliga
+NEGATIVE_CACHE_TTL_SECONDS = int(os.getenv("NEGATIVE_CACHE_TTL_SECONDS", "120"))
+MISSING_CUBES = NegativeCache("MISSING_CUBES", NEGATIVE_CACHE_TTL_SECONDS)
+MISSING_META = NegativeCache("MISSING_META", NEGATIVE_CACHE_TTL_SECONDS)
+
+# Single-flight: um único carregamento em andamento por (ambiente, key); os demais aguardam o resultado
+_INFLIGHT_LOCK = threading.Lock()
+_INFLIGHT: Dict[Tuple[str, str], Future] = {}
+
+# Leitura do CSV do CUBE em blocos de N linhas (pico de memória limitado); 0 lê tudo de uma vez
+CUBE_CSV_CHUNK_ROWS = int(os.getenv("CUBE_CSV_CHUNK_ROWS", "200000"))
+
+# Download do CUBE: GETs de faixas (Range) em paralelo, com retomada a partir do arquivo parcial
+S3_DOWNLOAD_PART_MB = float(os.getenv("S3_DOWNLOAD_PART_MB", "8"))
+S3_DOWNLOAD_CONCURRENCY = int(os.getenv("S3_DOWNLOAD_CONCURRENCY", "8"))
+# Lê o CUBE direto do body do get_object (gzip detectado pelo conteúdo), sem arquivo em disco: transferência
+# e parsing acontecem juntos. Se falhar, o carregamento segue pelo download para DATA_DIR.
+CUBE_STREAM_PARSE = os.getenv("CUBE_STREAM_PARSE", "0").strip().lower() in {"1", "true", "yes", "on"}
+# Barra de progresso do carregamento do CUBE na UI: intervalo de consulta e limite de consultas por página
+LOAD_PROGRESS_POLL_MS = int(os.getenv("LOAD_PROGRESS_POLL_MS", "1000"))
+LOAD_PROGRESS_MAX_POLLS = int(os.getenv("LOAD_PROGRESS_MAX_POLLS", "600"))
+
+# Cache colunar (Parquet) do CUBE já normalizado em DATA_DIR; sobrevive a restarts dos workers
+CUBE_PARQUET_CACHE = os.getenv("CUBE_PARQUET_CACHE", "1").strip().lower() not in {"0", "false", "no", "off"}
+PARQUET_ETAG_META = b"ai2c_source_etag"
 
 # Configurações de S3 a partir de variáveis de ambiente
 S3_BUCKET_BASE = os.getenv("S3_BUCKET_BASE", "ai2c-genai").strip()
 S3_REPORTS_PREFIX = os.getenv("S3_REPORTS_PREFIX", "ai2c-reports/reports").strip().strip("/")
 S3_INPUTS_PREFIX = os.getenv("S3_INPUTS_PREFIX", "integrador-inputs").strip().strip("/")
 AWS_REGION = os.getenv("AWS_REGION", "sa-east-1")
+# Variantes do CUBE procuradas no S3 ({key}_analytics_cube + extensão), em ordem de preferência;
+# .parquet exige pyarrow e .csv.zst exige zstandard (sem eles a variante é ignorada)
+CUBE_S3_FORMATS = [f.strip() for f in os.getenv("CUBE_S3_FORMATS", ".parquet,.csv.zst,.csv.gz,.csv").split(",") if f.strip()]
+# Cliente S3 único por processo (thread-safe); conexões HTTP reaproveitadas entre chamadas e threads
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", "16"))
 
 #. s3://ai2c-genai/integrador-inputs/6864dcc63d7d7502472acc62-questionnaires.csv
 
@@ -101,6 +359,36 @@ OPTIONAL_COL_DEFAULTS = {
     "confidence_level": None,
 }
 
+# Colunas de baixa cardinalidade guardadas como 'category' (menos memória, Parquet menor)
+CUBE_CATEGORICAL_COLS = [
+    "questionnaire_id","survey_id","question_id","category","topic","sentiment","intention",
+    "question_description"
+]
+
+# Pool de processos (spawn) para tarefas CPU-bound fora da thread do request; 0 workers = roda inline (padrão).
+# Opt-in: cada filho custa memória própria (importa wordcloud/PIL, ver cpu_tasks.py) — dimensione a task antes.
+CPU_POOL_WORKERS = int(os.getenv("CPU_POOL_WORKERS", "0"))
+CPU_POOL_MAX_QUEUE = int(os.getenv("CPU_POOL_MAX_QUEUE", "8"))  # tarefas em andamento + na fila, por processo web
+CPU_POOL_TIMEOUT_SECONDS = float(os.getenv("CPU_POOL_TIMEOUT_SECONDS", "20"))
+
+# PNGs das nuvens de palavras, endereçados pelo hash do conteúdo (servidos em BASE_PATH/wordcloud/<hash>.png)
+WORDCLOUD_CACHE_DIR = os.getenv("WORDCLOUD_CACHE_DIR", "").strip()  # vazio = DATA_DIR/wordclouds
+# Acima disso os PNGs menos usados (mtime mais antigo) são apagados até 80% do limite; 0 = sem limite
+WORDCLOUD_CACHE_MAX_BYTES = int(float(os.getenv("WORDCLOUD_CACHE_MAX_MB", "64")) * 1024 * 1024)
+WORDCLOUD_MAX_AGE_SECONDS = int(os.getenv("WORDCLOUD_MAX_AGE_SECONDS", str(365 * 24 * 3600)))
+WORDCLOUD_RENDER_VERSION = "1"  # mude quando os parâmetros do WordCloud mudarem (novos hashes)
+
+# Aba "Análise por Pergunta": cards por página (só os da página atual disparam callbacks); 0 = todos
+QUESTIONS_PAGE_SIZE = int(os.getenv("QUESTIONS_PAGE_SIZE", "10"))
+# Modo em lote: a página já chega com os gráficos de todos os cards (um round-trip), em vez de um callback por card
+QUESTIONS_BATCH_MODE = os.getenv("QUESTIONS_BATCH_MODE", "0").strip().lower() in {"1", "true", "yes", "on"}
+
+# Demais colunas de texto (segmentos etc.) viram 'category' no load quando têm poucos valores distintos
+CUBE_CATEGORY_MAX_UNIQUE = int(os.getenv("CUBE_CATEGORY_MAX_UNIQUE", "1000"))
+CUBE_CATEGORY_MAX_RATIO = float(os.getenv("CUBE_CATEGORY_MAX_RATIO", "0.5"))
+# Texto livre fica como 'object' (explode/split por linha)
+CUBE_TEXT_COLS = {"answer", "orig_answer"}
+
 NON_SEGMENTABLE = set(REQUIRED_COLS + list(OPTIONAL_COL_DEFAULTS.keys()) + ["answer", "orig_answer", "respondent_id"])
 
 RAW_FILTER_COLS = ["category","topic","sentiment","intention","question_description","canal adesao","cluster"]
@@ -248,52 +536,382 @@ def normalize_env(env_in: str) -> str:
 def resolve_bucket(env_resolved: str) -> str:
     return S3_BUCKET_BASE if env_resolved == "prod" else f"{S3_BUCKET_BASE}-{env_resolved}"
 
-def s3_path_for_key(env_resolved: str, key: str) -> str:
+def s3_path_for_key(env_resolved: str, key: str, ext: str = ".csv") -> str:
     bucket = resolve_bucket(env_resolved)
-    return f"s3://{bucket}/{S3_REPORTS_PREFIX}/{key}/{key}_analytics_cube.csv"
+    return f"s3://{bucket}/{S3_REPORTS_PREFIX}/{key}/{key}_analytics_cube{ext}"
 
-def _s3_download_to_tmp(env_resolved: str, key: str) -> Optional[str]:
-    """Baixa s3://.../{key}_analytics_cube.csv p/ /tmp e retorna caminho local, ou None se falhar."""
-    s3_uri = s3_path_for_key(env_resolved, key)
+def _cube_formats() -> List[str]:
+    """CUBE_S3_FORMATS que este processo consegue ler."""
+    unsupported = set() if HAS_PARQUET else {".parquet"}
+    if not HAS_ZSTD:
+        unsupported.add(".csv.zst")
+    return [ext for ext in CUBE_S3_FORMATS if ext not in unsupported]
+
+def _cube_ext(path: str) -> str:
+    return next((ext for ext in (".parquet", ".csv.zst", ".csv.gz") if path.endswith(ext)), ".csv")
+
+def _s3_split_uri(s3_uri: str) -> Tuple[str, str]:
     _, _, rest = s3_uri.partition("s3://")
     bucket, _, keypath = rest.partition("/")
+    return bucket, keypath
+
+_S3_CLIENT = None
+_S3_CLIENT_LOCK = threading.Lock()
+
+def _s3_client():
+    """Cliente S3 compartilhado pelo módulo, criado na primeira chamada (boto3.client não é thread-safe na criação)."""
+    global _S3_CLIENT
+    if _S3_CLIENT is None:
+        with _S3_CLIENT_LOCK:
+            if _S3_CLIENT is None:
+                _S3_CLIENT = boto3.client("s3", region_name=AWS_REGION,
+                                          config=BotoConfig(max_pool_connections=S3_MAX_POOL_CONNECTIONS))
+    return _S3_CLIENT
+
+# Leituras pequenas e independentes no S3 (ex.: candidatos de metadados) em paralelo
+_S3_IO_POOL = ThreadPoolExecutor(max_workers=max(1, min(8, S3_MAX_POOL_CONNECTIONS)), thread_name_prefix="s3-io")
+
+def _data_dir() -> str:
     local_dir = os.getenv("DATA_DIR", "/tmp")
     os.makedirs(local_dir, exist_ok=True)
-    local_path = os.path.join(local_dir, f"{key}_analytics_cube.csv")
-    s3 = boto3.client("s3", region_name=AWS_REGION)
+    return local_dir
+
+@contextmanager
+def _file_lock(path: str):
+    """Lock exclusivo entre processos (flock); sem efeito onde fcntl não existe."""
+    if fcntl is None:
+        yield
+        return
+    with open(path, "a") as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+def _cube_lock_path(key: str) -> str:
+    return os.path.join(_data_dir(), f"{key}_analytics_cube.csv.lock")
+
+def _s3_not_found(e: Exception) -> bool:
+    """Erro do S3 é "objeto não existe" (404/NoSuchKey)? Throttling, timeout, 403 etc. não são."""
+    resp = getattr(e, "response", None) or {}
+    code = str(resp.get("Error", {}).get("Code", ""))
+    return code in {"404", "NoSuchKey", "NotFound"} or resp.get("ResponseMetadata", {}).get("HTTPStatusCode") == 404
+
+def _s3_access_denied(e: Exception) -> bool:
+    resp = getattr(e, "response", None) or {}
+    return str(resp.get("Error", {}).get("Code", "")) in {"AccessDenied", "403"} \
+        or resp.get("ResponseMetadata", {}).get("HTTPStatusCode") == 403
+
+# Buckets em que o processo já sabe se tem s3:ListBucket. Sem ela o S3 responde 403 (não 404) a um objeto
+# inexistente, e a busca do CUBE vai direto aos HEADs
+_S3_LIST_DENIED: set = set()
+_S3_LIST_OK: set = set()
+
+def _s3_list_denied(bucket: str) -> bool:
+    """O bucket nega s3:ListBucket? Descoberto uma vez por processo (list_objects_v2 com MaxKeys=1)."""
+    if bucket in _S3_LIST_DENIED or bucket in _S3_LIST_OK:
+        return bucket in _S3_LIST_DENIED
     try:
-        print(f"[S3] Baixando {s3_uri} para {local_path}")
-        s3.download_file(bucket, keypath, local_path)
+        _s3_client().list_objects_v2(Bucket=bucket, MaxKeys=1)
+        _S3_LIST_OK.add(bucket)
+    except Exception as e:
+        if not _s3_access_denied(e):
+            return False  # não deu para saber agora: 403 segue valendo como erro
+        _S3_LIST_DENIED.add(bucket)
+        print(f"[S3] Sem permissão s3:ListBucket em {bucket}; 403 em objeto = objeto inexistente.")
+    return bucket in _S3_LIST_DENIED
+
+def _s3_missing(e: Exception, bucket: str) -> bool:
+    """Erro do S3 confirma que o objeto não existe: 404/NoSuchKey, ou 403 num bucket sem s3:ListBucket."""
+    return _s3_not_found(e) or (_s3_access_denied(e) and _s3_list_denied(bucket))
+
+def _s3_head_etag(s3_uri: str) -> Optional[str]:
+    """ETag atual do objeto no S3 (sem aspas; "" se o S3 não informar), ou None se o objeto não existe
+       (ver _s3_missing). Outras falhas (throttling, timeout, permissão) sobem como exceção."""
+    bucket, keypath = _s3_split_uri(s3_uri)
+    try:
+        head = _s3_client().head_object(Bucket=bucket, Key=keypath)
+    except Exception as e:
+        if _s3_missing(e, bucket):
+            return None
+        print(f"[S3] head_object falhou para {s3_uri}: {e}")
+        raise
+    return str(head.get("ETag") or "").strip('"')
+
+def _s3_find_cube(env_resolved: str, key: str) -> Optional[Dict[str, str]]:
+    """Variante do CUBE publicada no S3, na ordem de CUBE_S3_FORMATS: {"uri", "ext", "etag"}.
+       None só quando a consulta confirmou que nenhuma variante existe; falhas de consulta sobem como exceção.
+       Um list_objects_v2 pelo prefixo resolve todas as variantes; sem permissão de listagem,
+       HEADs em paralelo (vence a de maior prioridade que existir)."""
+    formats = _cube_formats()
+    bucket, base = _s3_split_uri(s3_path_for_key(env_resolved, key, ""))
+    listed = False
+    if bucket not in _S3_LIST_DENIED:
+        try:
+            resp = _s3_client().list_objects_v2(Bucket=bucket, Prefix=base)
+            found = {obj["Key"][len(base):]: str(obj.get("ETag") or "").strip('"') or None
+                     for obj in resp.get("Contents", [])}
+            ext = next((ext for ext in formats if ext in found), None)
+            etag = found.get(ext)
+            listed = True
+            _S3_LIST_OK.add(bucket)
+        except Exception as e:
+            if _s3_access_denied(e):
+                _S3_LIST_DENIED.add(bucket)
+                print(f"[S3] Sem permissão s3:ListBucket em {bucket} ({e}); as próximas buscas do CUBE usam só HEAD.")
+            else:
+                print(f"[S3] list_objects_v2 falhou para s3://{bucket}/{base}* ({e}); consultando variantes por HEAD.")
+    if not listed:
+        futures = [_S3_IO_POOL.submit(_s3_head_etag, s3_path_for_key(env_resolved, key, ext)) for ext in formats]
+        try:
+            # em ordem de prioridade: erro numa variante preferida sobe (não cai para uma pior às cegas)
+            ext, etag = next(((ext, fut.result() or None) for ext, fut in zip(formats, futures)
+                              if fut.result() is not None), (None, None))
+        finally:
+            for fut in futures:
+                fut.cancel()
+    if ext is None:
+        print(f"[S3] Nenhuma variante do CUBE ({', '.join(formats)}) em s3://{bucket}/{base}")
+        return None
+    return {"uri": s3_path_for_key(env_resolved, key, ext), "ext": ext, "etag": etag}
+
+def _write_json_atomic(path: str, obj: dict) -> None:
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(obj, f)
+    os.replace(tmp_path, path)
+
+def _read_json(path: str) -> Optional[dict]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+# Progresso do carregamento do CUBE em DATA_DIR (visível para todos os workers); ver update_load_progress.
+# stage: "start", "download" (bytes_done/bytes_total), "parse", "ready" ou "error"
+def _load_progress_path(env_resolved: str, key: str) -> str:
+    return os.path.join(_data_dir(), f"{key}_{env_resolved}_load_progress.json")
+
+def _set_load_progress(env_resolved: str, key: str, stage: str, done: int = 0, total: int = 0) -> None:
+    try:
+        _write_json_atomic(_load_progress_path(env_resolved, key),
+                           {"stage": stage, "bytes_done": int(done), "bytes_total": int(total), "updated_at": time.time()})
+    except OSError as e:
+        print(f"[LOAD] Falha ao gravar progresso de {key}: {e}")
+
+def load_progress(env_resolved: str, key: str) -> Optional[dict]:
+    return _read_json(_load_progress_path(env_resolved, key))
+
+def _s3_download_to_tmp(env_resolved: str, key: str, s3_uri: Optional[str] = None,
+                        progress: bool = True) -> Optional[str]:
+    """Baixa o CUBE (`s3_uri`; padrão s3://.../{key}_analytics_cube.csv) p/ DATA_DIR com a mesma extensão
+       e retorna caminho local, ou None se falhar. `progress=False` (refresh em background) não grava
+       o progresso exibido na UI.
+       Faixas de S3_DOWNLOAD_PART_MB em S3_DOWNLOAD_CONCURRENCY GETs paralelos (If-Match no ETag), gravadas em
+       `.part` + manifesto das partes concluídas: um download interrompido retoma de onde parou e o arquivo
+       final só aparece (rename atômico) quando completo."""
+    s3_uri = s3_uri or s3_path_for_key(env_resolved, key)
+    bucket, keypath = _s3_split_uri(s3_uri)
+    local_path = os.path.join(_data_dir(), f"{key}_analytics_cube{_cube_ext(keypath)}")
+    part_path = f"{local_path}.part"
+    manifest_path = f"{part_path}.json"
+    s3 = _s3_client()
+    try:
+        head = s3.head_object(Bucket=bucket, Key=keypath)
+        size, etag = int(head.get("ContentLength") or 0), str(head.get("ETag") or "")
+        part_size = max(1, int(S3_DOWNLOAD_PART_MB * 1024 * 1024))
+        ranges = [(i, start, min(start + part_size, size) - 1) for i, start in enumerate(range(0, size, part_size))]
+
+        manifest = _read_json(manifest_path) or {}
+        resumable = (manifest.get("etag"), manifest.get("size"), manifest.get("part_size")) == (etag, size, part_size) \
+            and os.path.exists(part_path) and os.path.getsize(part_path) == size
+        done = set(manifest.get("done", [])) if resumable else set()
+        if not resumable:
+            with open(part_path, "wb") as f:
+                f.truncate(size)
+        bytes_done = [sum(end - start + 1 for i, start, end in ranges if i in done)]
+        report = (lambda: _set_load_progress(env_resolved, key, "download", bytes_done[0], size)) if progress else (lambda: None)
+        print(f"[S3] Baixando {s3_uri} para {local_path} | {size} bytes em {len(ranges)} partes"
+              + (f" (retomando: {len(done)} prontas)" if done else ""))
+        report()
+
+        lock = threading.Lock()
+        def _fetch(i: int, start: int, end: int) -> None:
+            obj = s3.get_object(Bucket=bucket, Key=keypath, Range=f"bytes={start}-{end}", IfMatch=etag)
+            with open(part_path, "r+b") as f:
+                f.seek(start)
+                shutil.copyfileobj(obj["Body"], f, 1 << 20)
+            with lock:
+                done.add(i)
+                bytes_done[0] += end - start + 1
+                _write_json_atomic(manifest_path, {"etag": etag, "size": size, "part_size": part_size, "done": sorted(done)})
+                report()
+
+        pending = [r for r in ranges if r[0] not in done]
+        with ThreadPoolExecutor(max_workers=max(1, min(S3_DOWNLOAD_CONCURRENCY, len(pending))),
+                                thread_name_prefix="s3-download") as pool:
+            for fut in [pool.submit(_fetch, *r) for r in pending]:
+                fut.result()
+        os.replace(part_path, local_path)
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
         print(f"[S3] Download de {s3_uri} concluído.")
         return local_path
     except Exception as e:
+        status = getattr(e, "response", {}).get("ResponseMetadata", {}).get("HTTPStatusCode")
+        if status == 412:  # objeto mudou no meio do download: as partes já baixadas não servem mais
+            for path in (part_path, manifest_path):
+                if os.path.exists(path):
+                    os.remove(path)
         print(f"[S3] Falha ao baixar {s3_uri}: {e}")
         return None
 
-def read_csv_robust(path: str) -> pd.DataFrame:
-    for enc in ["utf-8", "utf-8-sig", "latin1", "iso-8859-1"]:
-        try:
-            with open(path, "r", encoding=enc, errors="ignore") as f:
-                sample = f.read(4096)
-                delim = csv.Sniffer().sniff(sample, delimiters=",;\t|").delimiter
-            df = pd.read_csv(path, sep=delim, encoding=enc, dtype=str, na_values=["", "NA", "N/A", "null", "NULL", "None"])
-            df.columns = df.columns.str.strip()
-            print(f"✓ CSV lido: {os.path.basename(path)} | enc={enc} sep='{delim}'")
-            return df
-        except Exception:
-            continue
-    return pd.read_csv(path, sep=None, engine="python", encoding="utf-8", on_bad_lines="skip", dtype=str)
+CSV_ENCODINGS = ["utf-8", "utf-8-sig", "latin1", "iso-8859-1"]
+CSV_NA_VALUES = ["", "NA", "N/A", "null", "NULL", "None"]
+CSV_SNIFF_BYTES = 64 * 1024
+
+def _sniff_csv(head: bytes) -> Tuple[str, Optional[str]]:
+    """Detecta (encoding, delimitador) a partir dos primeiros bytes do arquivo."""
+    enc = "latin1"
+    if head.startswith(codecs.BOM_UTF8):
+        enc = "utf-8-sig"
+    else:
+        for cand in CSV_ENCODINGS:
+            try:
+                head.decode(cand)
+            except UnicodeDecodeError as e:
+                # caractere multibyte cortado no fim da amostra não invalida o encoding
+                if not (e.reason == "unexpected end of data" and e.start >= len(head) - 3):
+                    continue
+            enc = cand
+            break
+    try:
+        delim = csv.Sniffer().sniff(head.decode(enc, errors="ignore")[:4096], delimiters=",;\t|").delimiter
+    except csv.Error:
+        delim = None
+    return enc, delim
+
+def _strip_chunk_columns(reader):
+    for chunk in reader:
+        chunk.columns = chunk.columns.str.strip()
+        yield chunk
+
+def _read_csv_sniffed(src, head: bytes, name: str, chunksize: Optional[int], encoding: Optional[str]):
+    enc, delim = _sniff_csv(head)
+    enc = encoding or enc
+    if delim is None:
+        print(f"[CSV] Delimitador não detectado em {name}; usando engine python.")
+        reader = pd.read_csv(src, sep=None, engine="python", encoding=enc, on_bad_lines="skip",
+                             dtype=str, chunksize=chunksize)
+    else:
+        reader = pd.read_csv(src, sep=delim, encoding=enc, dtype=str, na_values=CSV_NA_VALUES,
+                             chunksize=chunksize)
+    print(f"✓ CSV lido: {name} | enc={enc} sep='{delim or '?'}' | chunk={chunksize or '-'}")
+    if chunksize is None:
+        reader.columns = reader.columns.str.strip()
+        return reader
+    return _strip_chunk_columns(reader)
+
+def _open_csv_bytes(path: str):
+    """Arquivo binário descompactado conforme a extensão (.gz / .zst)."""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if path.endswith(".zst"):
+        if not HAS_ZSTD:
+            raise RuntimeError("Para ler .csv.zst, instale: pip install zstandard")
+        return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+    return open(path, "rb")
+
+def read_csv_robust(path: str, chunksize: Optional[int] = None, encoding: Optional[str] = None):
+    """Lê o CSV (também .csv.gz / .csv.zst) detectando encoding e delimitador uma única vez pelo começo do arquivo.
+       Com `chunksize` devolve um iterador de DataFrames (streaming); sem, o DataFrame inteiro."""
+    with _open_csv_bytes(path) as f:
+        head = f.read(CSV_SNIFF_BYTES)
+    return _read_csv_sniffed(path, head, os.path.basename(path), chunksize, encoding)
+
+class _PrefixedReader(io.RawIOBase):
+    """Leitura binária sequencial de `src` (ex.: body do get_object) devolvendo antes os bytes `head`
+       já consumidos para detecção; `on_bytes(n)` é chamado a cada leitura de `src` (progresso)."""
+    def __init__(self, src, head: bytes = b"", on_bytes=None):
+        self._src, self._head, self._on_bytes = src, head, on_bytes
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        if self._head:
+            n = min(len(b), len(self._head))
+            b[:n], self._head = self._head[:n], self._head[n:]
+            return n
+        data = self._src.read(len(b))
+        b[:len(data)] = data
+        if self._on_bytes and data:
+            self._on_bytes(len(data))
+        return len(data)
+
+def read_csv_stream(stream, name: str, chunksize: Optional[int] = None):
+    """Como `read_csv_robust`, sobre um fluxo binário que não volta ao início: encoding e delimitador
+       saem do primeiro buffer, que é devolvido ao parser na frente do resto do fluxo."""
+    head = stream.read(CSV_SNIFF_BYTES)
+    return _read_csv_sniffed(io.BufferedReader(_PrefixedReader(stream, head), 1 << 20), head, name, chunksize, None)
+
+def _parquet_cache_path(env_resolved: str, key: str) -> str:
+    return os.path.join(_data_dir(), f"{key}_{env_resolved}_analytics_cube.parquet")
+
+def _read_parquet_cache(env_resolved: str, key: str, etag: Optional[str]) -> Optional[pd.DataFrame]:
+    """Lê o CUBE normalizado do Parquet local (memory-map) se o ETag gravado bate com o do S3."""
+    if not (HAS_PARQUET and CUBE_PARQUET_CACHE and etag):
+        return None
+    path = _parquet_cache_path(env_resolved, key)
+    if not os.path.exists(path):
+        return None
+    try:
+        meta = pq.read_schema(path, memory_map=True).metadata or {}
+        cached_etag = meta.get(PARQUET_ETAG_META, b"").decode("utf-8")
+        if cached_etag != etag:
+            print(f"[PARQUET] {os.path.basename(path)} desatualizado (etag {cached_etag or '-'} != {etag}).")
+            return None
+        df = pq.read_table(path, memory_map=True).to_pandas()
+        print(f"[PARQUET] CUBE lido de {path} | etag={etag} | linhas={len(df)}")
+        return _categorize_low_cardinality(df)  # Parquets gravados antes da regra de cardinalidade
+    except Exception as e:
+        print(f"[PARQUET] Falha ao ler {path}: {e}")
+        return None
+
+def _write_parquet_cache(df: pd.DataFrame, env_resolved: str, key: str, etag: Optional[str]) -> None:
+    """Persiste o CUBE normalizado (com dtypes 'category') + ETag de origem nos metadados do Parquet."""
+    if not (HAS_PARQUET and CUBE_PARQUET_CACHE and etag):
+        return
+    path = _parquet_cache_path(env_resolved, key)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        meta = dict(table.schema.metadata or {})
+        meta[PARQUET_ETAG_META] = etag.encode("utf-8")
+        pq.write_table(table.replace_schema_metadata(meta), tmp_path)
+        os.replace(tmp_path, path)  # escrita atômica: outro worker nunca lê arquivo pela metade
+        print(f"[PARQUET] CUBE gravado em {path} | etag={etag}")
+    except Exception as e:
+        print(f"[PARQUET] Falha ao gravar {path}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
 
 
 def _s3_read_text(bucket: str, key: str) -> Optional[str]:
+    """Conteúdo do objeto, ou None se ele não existe (ver _s3_missing); outras falhas sobem como exceção."""
     try:
-        s3 = boto3.client("s3", region_name=AWS_REGION)
+        s3 = _s3_client()
         obj = s3.get_object(Bucket=bucket, Key=key)
         content = obj["Body"].read().decode("utf-8", errors="ignore")
         print(f"[DEBUG] SUCESSO ao ler s3://{bucket}/{key}. Tamanho: {len(content)} bytes.")
         return content
     except Exception as e:
+        if not _s3_missing(e, bucket):
+            print(f"[S3] Falha ao ler s3://{bucket}/{key}: {e}")
+            raise
         print(f"[S3] not found: s3://{bucket}/{key} ({e})")
         return None
 
@@ -303,14 +921,21 @@ def _s3_read_text(bucket: str, key: str) -> Optional[str]:
 
 
 # Cache unificado para metadados de questionários
-QUESTION_META_CACHE = {}
+QUESTION_META_CACHE_MAX_BYTES = int(float(os.getenv("QUESTION_META_CACHE_MAX_MB", "16")) * 1024 * 1024)
+QUESTION_META_CACHE = LRUCache(
+    "QUESTION_META_CACHE", QUESTION_META_CACHE_MAX_BYTES,
+    lambda meta: len(json.dumps(meta, default=list, ensure_ascii=False))
+)
 
 def load_questionnaire_meta(env_resolved: str, key: str) -> dict:
     """Carrega tipos/opções/títulos do questionário.
        Prioridade: JSON > CSV. Busca no bucket do ambiente e, se faltar, no bucket base (ai2c-genai)."""
     cache_key = (env_resolved, key)
-    if cache_key in QUESTION_META_CACHE:
-        return QUESTION_META_CACHE[cache_key]
+    cached = QUESTION_META_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+    if MISSING_META.get(cache_key) is not None:
+        return {"qtype_map": {}, "options_map": {}, "title_map": {}, "open_questions": set()}
 
     env_bucket  = resolve_bucket(env_resolved)        # ex.: ai2c-genai-dev
     base_bucket = S3_BUCKET_BASE                      # ex.: ai2c-genai
@@ -338,38 +963,44 @@ def load_questionnaire_meta(env_resolved: str, key: str) -> dict:
             "open_questions": {str(k) for k, v in qtypes_norm.items() if v == "open-ended"},
         }
 
-    # 1) TENTA JSON nos dois buckets (env depois base). Se achar, retorna imediatamente.
-    for bucket in (env_bucket, base_bucket):
-        skey = paths[0]  # JSON
-        txt = _s3_read_text(bucket, skey)
-        if txt:
-            try:
-                parsed = _parse_questionnaires_json(txt)
-                meta = _from_parsed_dict(parsed)
-                QUESTION_META_CACHE[cache_key] = meta
-                print(f"[META] OK JSON em s3://{bucket}/{skey} ⇒ tipos: {meta.get('qtype_map')}")
-                return meta
-            except Exception as e:
-                print("[questionnaire meta] parse JSON error:", skey, e)
-
-    # 2) Se JSON não existir, TENTA CSV nos dois buckets.
-    for bucket in (env_bucket, base_bucket):
-        skey = paths[1]  # CSV
-        txt = _s3_read_text(bucket, skey)
-        if txt:
+    # 1) JSON nos dois buckets (env depois base), 2) CSV nos dois buckets.
+    # Os candidatos são buscados em paralelo; vence o de maior prioridade que existir e for válido.
+    candidates = list(dict.fromkeys([(env_bucket, paths[0], "JSON"), (base_bucket, paths[0], "JSON"),
+                                     (env_bucket, paths[1], "CSV"), (base_bucket, paths[1], "CSV")]))
+    futures = [_S3_IO_POOL.submit(_s3_read_text, bucket, skey) for bucket, skey, _ in candidates]
+    lookup_failed = False  # algum candidato não pôde ser consultado (throttling, timeout, permissão...)
+    try:
+        for (bucket, skey, fmt), fut in zip(candidates, futures):
             try:
-                parsed = _parse_questionnaires_csv(txt)
-                meta = _from_parsed_dict(parsed)
-                QUESTION_META_CACHE[cache_key] = meta
-                print(f"[META] OK CSV em s3://{bucket}/{skey} ⇒ tipos: {meta.get('qtype_map')}")
-                return meta
-            except Exception as e:
-                print("[questionnaire meta] parse CSV error:", skey, e)
-
-    # 3) Fallback vazio (vai cair na heurística só se for necessário)
+                txt = fut.result()
+            except Exception:
+                lookup_failed = True
+                continue
+            if txt:
+                try:
+                    parsed = _parse_questionnaires_json(txt) if fmt == "JSON" else _parse_questionnaires_csv(txt)
+                    meta = _from_parsed_dict(parsed)
+                    # com um candidato preferido sem resposta, usa este agora mas não fixa no cache
+                    if not lookup_failed:
+                        QUESTION_META_CACHE[cache_key] = meta
+                    print(f"[META] OK {fmt} em s3://{bucket}/{skey} ⇒ tipos: {meta.get('qtype_map')}")
+                    return meta
+                except Exception as e:
+                    print(f"[questionnaire meta] parse {fmt} error:", skey, e)
+    finally:
+        for fut in futures:
+            fut.cancel()
+
+    # 3) Fallback vazio (vai cair na heurística só se for necessário). Só uma ausência confirmada vai para
+    #    o cache negativo (vale pelo TTL, para o questionário aparecer se for enviado depois); falha de consulta
+    #    não é cacheada e a próxima chamada tenta de novo
     empty = {"qtype_map": {}, "options_map": {}, "title_map": {}, "open_questions": set()}
-    QUESTION_META_CACHE[cache_key] = empty
-    print("[META] Não encontrado JSON/CSV de questionário; usando heurística como fallback.")
+    if lookup_failed:
+        print("[META] Falha ao consultar o questionário no S3; usando heurística como fallback nesta chamada.")
+        return empty
+    MISSING_META.add(cache_key, "questionário não encontrado")
+    print(f"[META] Não encontrado JSON/CSV de questionário; usando heurística como fallback "
+          f"(nova busca em {NEGATIVE_CACHE_TTL_SECONDS}s).")
     return empty
 
 
@@ -576,6 +1207,13 @@ def get_qtype_for_question_with_meta(env_resolved: str, qid: str, series: pd.Ser
 
 
 
+def cube_state(cube: dict, env_resolved: str, key: str) -> Dict:
+    """`build_state` do CUBE, calculado uma vez por carga e guardado na própria entrada do DF_CACHE."""
+    state = cube.get("state")
+    if state is None:
+        state = _cube_attach(cube, "state", build_state(cube["df"], env_resolved=env_resolved, key=key))
+    return state
+
 def build_state(df: pd.DataFrame, env_resolved: Optional[str] = None, key: Optional[str] = None) -> Dict:
     """Cria um dicionário de estado a partir de um DataFrame + metadados do questionário."""
     if df.empty:
@@ -605,7 +1243,7 @@ def build_state(df: pd.DataFrame, env_resolved: Optional[str] = None, key: Optio
     }
 
     qdf = df[["question_id", "question_description"]].drop_duplicates()
-    qdf["__ord"] = qdf["question_id"].apply(numeric_suffix)
+    qdf["__ord"] = qdf["question_id"].astype(str).apply(numeric_suffix)
     qdf = qdf.sort_values(["__ord", "question_id"]).drop(columns="__ord")
 
     qdesc_map = {
@@ -637,13 +1275,18 @@ def build_state(df: pd.DataFrame, env_resolved: Optional[str] = None, key: Optio
     }
 
 
+MOJIBAKE_MAP = {"√£":"ã","√≥":"ó","√°":"á","√©":"é","√™":"ê","√∫":"ú","√º":"ú","√ß":"ç",
+                "ƒÂ£":"ã","ƒÂ¡":"á","ƒÂ©":"é","ƒÂª":"ê","ƒÂº":"ú","ƒÂ³":"ó","ƒÂ§":"ç","ƒÃ±":"ñ",
+                "N√£o":"Não","n√£o":"não"}
+# uma passada só; chaves mais longas primeiro (equivale aos replace() em sequência)
+_MOJIBAKE_RX = re.compile("|".join(re.escape(k) for k in sorted(MOJIBAKE_MAP, key=len, reverse=True)))
+
+def _mojibake_sub(m: "re.Match") -> str:
+    return MOJIBAKE_MAP[m.group(0)]
+
 def fix_mojibake(s: str) -> str:
     if not isinstance(s, str): return s
-    rep = {"√£":"ã","√≥":"ó","√°":"á","√©":"é","√™":"ê","√∫":"ú","√º":"ú","√ß":"ç",
-           "ƒÂ£":"ã","ƒÂ¡":"á","ƒÂ©":"é","ƒÂª":"ê","ƒÂº":"ú","ƒÂ³":"ó","ƒÂ§":"ç","ƒÃ±":"ñ",
-           "N√£o":"Não","n√£o":"não"}
-    for k,v in rep.items(): s = s.replace(k,v)
-    return s
+    return _MOJIBAKE_RX.sub(_mojibake_sub, s)
 
 def coerce_sentiment_series(s: pd.Series) -> pd.Series:
     if s is None or s.empty:
@@ -676,52 +1319,511 @@ def intention_bar_fig(sub_df: pd.DataFrame, top_n: int = 20) -> Optional[go.Figu
     return responsive_axis(fig, labels=df_bar["Intenção"].tolist())
 
 
-def load_df_for_key(env_resolved: str, key: str) -> pd.DataFrame:
-    """Carrega DF do CUBE para (env, key) com cache em memória e download do S3 se necessário."""
-    k = (env_resolved, key)
-    if k in DF_CACHE:
-        return DF_CACHE[k]
-
-    local_path = _s3_download_to_tmp(env_resolved, key)
-    if not local_path or not os.path.exists(local_path):
-        fallback_path = f"{key}_analytics_cube.csv"
-        print(f"Download do S3 falhou. Tentando fallback local: {fallback_path}")
-        if os.path.exists(fallback_path):
-            local_path = fallback_path
-        else:
-            raise FileNotFoundError(f"Cubo de dados não encontrado para key='{key}' no ambiente='{env_resolved}'")
+MOJIBAKE_COLS = ["question_description","category","topic","sentiment","intention"]
 
-    df = read_csv_robust(local_path)
-    
+def _map_uniques(s: pd.Series, fn, as_category: bool = False) -> pd.Series:
+    """Aplica `fn` (Series -> Series, vetorizada) apenas nos valores distintos de `s` e
+       expande o resultado pelos códigos; com `as_category` já devolve a coluna como 'category'."""
+    codes, uniques = pd.factorize(s, use_na_sentinel=False)
+    mapped = fn(pd.Series(uniques, dtype=object)).to_numpy()
+    if as_category:
+        cat = pd.Categorical(mapped)
+        values = pd.Categorical.from_codes(cat.codes.take(codes), categories=cat.categories)
+    else:
+        values = mapped.take(codes)
+    return pd.Series(values, index=s.index, name=s.name)
+
+def _strip_values(u: pd.Series) -> pd.Series:
+    return u.astype(str).str.strip().replace({"nan": None, "None": None})
+
+def _fix_mojibake_values(u: pd.Series) -> pd.Series:
+    return u.astype(str).str.replace(_MOJIBAKE_RX, _mojibake_sub, regex=True)
+
+def _normalize_sentiment_values(u: pd.Series) -> pd.Series:
+    base = u.astype(str).str.strip().str.lower()
+    return base.map(SENTIMENT_MAP).fillna(base).where(u.notna(), None)
+
+def _cube_columns(names: List[str]) -> List[str]:
+    """Colunas que o CUBE mantém, qualquer que seja o formato publicado: obrigatórias + não-PII
+       (PII nunca é exibida). O leitor de Parquet usa a mesma lista como projeção."""
+    return [c for c in names if c in REQUIRED_COLS or c.strip() in OPTIONAL_COL_DEFAULTS or not is_pii(c.strip())]
+
+def _guess_date_format(raw: pd.Series) -> Optional[str]:
+    """Formato de date_of_response inferido dos primeiros valores preenchidos (None = o pandas infere)."""
+    for v in raw.dropna().head(100):
+        fmt = guess_datetime_format(str(v).strip())
+        if fmt:
+            return fmt
+    return None
+
+def _prepare_cube(df: pd.DataFrame, date_format: Optional[str] = None) -> pd.DataFrame:
+    """Valida e normaliza o CUBE lido (strip, mojibake, sentimento, datas, dtypes), sem as colunas PII.
+       Cada coluna é normalizada uma vez por valor distinto, não por linha. `date_format` evita
+       inferir o formato das datas de novo em cada bloco."""
     missing = [c for c in REQUIRED_COLS if c not in df.columns]
     if missing:
         raise ValueError(f"Colunas obrigatórias ausentes no CUBE: {missing}")
+    pii = set(df.columns) - set(_cube_columns(list(df.columns)))
+    if pii:
+        df = df.drop(columns=[c for c in df.columns if c in pii])
 
     for col, default in OPTIONAL_COL_DEFAULTS.items():
         if col not in df.columns:
             df[col] = default
 
-    for c in REQUIRED_COLS:
-        df[c] = df[c].astype(str).map(lambda x: x.strip() if isinstance(x, str) else x).replace({"nan": None, "None": None})
-
-    for c in ["question_description","category","topic","sentiment","intention"]:
-        if c in df.columns:
-            df[c] = df[c].astype(str).map(fix_mojibake)
+    def _pipeline(col: str):
+        steps = [_strip_values]
+        if col in MOJIBAKE_COLS:
+            steps.append(_fix_mojibake_values)
+        if col == "sentiment":
+            steps.append(_normalize_sentiment_values)
+        if col == "date_of_response":
+            steps.append(lambda u: pd.to_datetime(u, errors="coerce", format=date_format))
+        def run(u: pd.Series) -> pd.Series:
+            for step in steps:
+                u = step(u)
+            return u
+        return run
 
-    if "sentiment" in df.columns:
-        df["sentiment"] = df["sentiment"].map(normalize_sentiment)
-
-    if "date_of_response" in df.columns:
-        df["date_of_response"] = pd.to_datetime(df["date_of_response"], errors="coerce")
+    for c in REQUIRED_COLS:
+        df[c] = _map_uniques(df[c], _pipeline(c), as_category=c in CUBE_CATEGORICAL_COLS)
 
     if "confidence_level" in df.columns:
         df["confidence_level"] = pd.to_numeric(df["confidence_level"], errors="coerce")
 
-    df["answer"] = df["orig_answer"].astype(str).map(fix_mojibake)
+    # resposta vazia vira "None" como no texto original (o factorize troca None por NaN, que viraria "nan")
+    df["answer"] = _map_uniques(df["orig_answer"], lambda u: _fix_mojibake_values(u.where(u.notna(), None)))
 
-    DF_CACHE[k] = df
+    for c in CUBE_CATEGORICAL_COLS:
+        if c in df.columns and not isinstance(df[c].dtype, pd.CategoricalDtype):
+            df[c] = df[c].astype("category")
     return df
 
+def _concat_cube_chunks(chunks: List[pd.DataFrame]) -> pd.DataFrame:
+    """Concatena blocos já normalizados unindo as categorias (sem voltar para 'object').
+       Coluna a coluna, tirando cada uma dos blocos ao juntá-la: o pico fica em ~1 CUBE + 1 coluna, não 2 CUBEs."""
+    if len(chunks) == 1:
+        return chunks[0]
+    out = {}
+    for c in list(chunks[0].columns):
+        parts = [ch.pop(c) for ch in chunks]
+        if isinstance(parts[0].dtype, pd.CategoricalDtype):
+            out[c] = pd.Series(union_categoricals(parts, sort_categories=True), name=c)
+        else:
+            out[c] = pd.concat(parts, ignore_index=True)
+        del parts
+    return pd.DataFrame(out, copy=False)
+
+def _categorize_low_cardinality(df: pd.DataFrame) -> pd.DataFrame:
+    """Converte para 'category' as colunas de texto restantes com até CUBE_CATEGORY_MAX_UNIQUE valores
+       distintos (e no máx. CUBE_CATEGORY_MAX_RATIO das linhas): filtros e contagens passam a usar os códigos."""
+    n = len(df)
+    for c in df.columns:
+        if c in CUBE_TEXT_COLS or df[c].dtype != object:
+            continue
+        u = df[c].nunique(dropna=True)
+        if u <= CUBE_CATEGORY_MAX_UNIQUE and u <= CUBE_CATEGORY_MAX_RATIO * max(1, n):
+            df[c] = df[c].astype("category")
+    return df
+
+def _build_cube_from_reader(reader) -> pd.DataFrame:
+    """Normaliza/categoriza cada bloco do leitor de CSV antes de juntar (pico de RSS limitado).
+       O formato das datas é inferido no 1º bloco e vale para todos."""
+    chunks, date_format = [], None
+    for ch in [reader] if isinstance(reader, pd.DataFrame) else reader:
+        if not chunks and "date_of_response" in ch.columns:
+            date_format = _guess_date_format(ch["date_of_response"])
+        chunks.append(_prepare_cube(ch, date_format))
+    return _categorize_low_cardinality(_concat_cube_chunks(chunks))
+
+def _build_cube_from_csv(path: str, encoding: Optional[str] = None) -> pd.DataFrame:
+    """Lê o CSV em blocos, normalizando/categorizando cada bloco antes de juntar (pico de RSS limitado)."""
+    try:
+        return _build_cube_from_reader(read_csv_robust(path, chunksize=CUBE_CSV_CHUNK_ROWS or None, encoding=encoding))
+    except UnicodeDecodeError as e:
+        if encoding == "latin1":
+            raise
+        print(f"[CSV] Encoding detectado falhou no meio de {os.path.basename(path)} ({e}); relendo como latin1.")
+        return _build_cube_from_csv(path, encoding="latin1")
+
+def _arrow_as_csv_text(batch: "pa.RecordBatch") -> pd.DataFrame:
+    """Bloco do Parquet como o CSV chegaria ao pandas: todas as colunas texto, marcadores de vazio como nulo."""
+    na = pa.array(CSV_NA_VALUES)
+    arrays = []
+    for col in batch.columns:
+        if pa.types.is_dictionary(col.type):
+            col = col.dictionary_decode()
+        if not pa.types.is_string(col.type):
+            col = pc.cast(col, pa.string())
+        arrays.append(pc.if_else(pc.is_in(col, value_set=na), pa.scalar(None, pa.string()), col))
+    df = pa.RecordBatch.from_arrays(arrays, names=batch.schema.names).to_pandas()
+    df.columns = df.columns.str.strip()
+    return df
+
+def _build_cube_from_parquet(path: str) -> pd.DataFrame:
+    """CUBE publicado em Parquet: lê só as colunas usadas, em blocos de CUBE_CSV_CHUNK_ROWS linhas,
+       e normaliza como o CSV."""
+    pf = pq.ParquetFile(path, memory_map=True)
+    names = pf.schema_arrow.names
+    cols = _cube_columns(names)
+    print(f"[PARQUET] {os.path.basename(path)} | {pf.metadata.num_rows} linhas | "
+          f"colunas lidas {len(cols)}/{len(names)} (fora: {sorted(set(names) - set(cols)) or '-'})")
+    batch_size = CUBE_CSV_CHUNK_ROWS if CUBE_CSV_CHUNK_ROWS > 0 else max(1, pf.metadata.num_rows)
+    return _build_cube_from_reader(_arrow_as_csv_text(b) for b in pf.iter_batches(batch_size=batch_size, columns=cols))
+
+def _build_cube_from_file(path: str) -> pd.DataFrame:
+    """CUBE a partir do arquivo baixado, pelo leitor da extensão (.parquet ou CSV, compactado ou não)."""
+    if _cube_ext(path) == ".parquet":
+        return _build_cube_from_parquet(path)
+    return _build_cube_from_csv(path)
+
+def _s3_stream_cube(env_resolved: str, key: str, s3_uri: Optional[str] = None) -> Tuple[Optional[pd.DataFrame], Optional[str]]:
+    """CUBE_STREAM_PARSE: (DF, ETag) do CSV lidos direto do body do get_object, descompactando gzip/zstd pela
+       assinatura do conteúdo. Qualquer falha devolve (None, None) e o chamador segue pelo download."""
+    s3_uri = s3_uri or s3_path_for_key(env_resolved, key)
+    bucket, keypath = _s3_split_uri(s3_uri)
+    try:
+        obj = _s3_client().get_object(Bucket=bucket, Key=keypath)
+        body, total = obj["Body"], int(obj.get("ContentLength") or 0)
+        raw_head = body.read(CSV_SNIFF_BYTES)
+        seen = [len(raw_head), 0]  # bytes lidos do S3, bytes no último registro de progresso
+
+        def _on_bytes(n: int) -> None:
+            seen[0] += n
+            if seen[0] - seen[1] >= (1 << 20):
+                seen[1] = seen[0]
+                _set_load_progress(env_resolved, key, "download", seen[0], total)
+
+        _set_load_progress(env_resolved, key, "download", seen[0], total)
+        stream = io.BufferedReader(_PrefixedReader(body, raw_head, _on_bytes), 1 << 20)
+        codec = "gzip" if raw_head[:2] == b"\x1f\x8b" else "zstd" if raw_head[:4] == b"\x28\xb5\x2f\xfd" else None
+        if codec == "gzip":
+            stream = gzip.GzipFile(fileobj=stream)
+        elif codec == "zstd":
+            if not HAS_ZSTD:
+                raise RuntimeError("zstandard não instalado")
+            stream = io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(stream), 1 << 20)
+        print(f"[S3] Lendo {s3_uri} em streaming | {total} bytes{f' ({codec})' if codec else ''}")
+        df = _build_cube_from_reader(read_csv_stream(stream, os.path.basename(keypath), CUBE_CSV_CHUNK_ROWS or None))
+        etag = str(obj.get("ETag") or "").strip('"') or None
+        print(f"[S3] {s3_uri} lido em streaming | etag={etag} | linhas={len(df)}")
+        return df, etag
+    except Exception as e:
+        print(f"[S3] Leitura em streaming de {s3_uri} falhou ({e}); seguindo pelo download.")
+        return None, None
+
+def _build_question_index(df: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """question_id -> posições (ordem original) das linhas da pergunta; montado uma vez por CUBE."""
+    if df.empty or "question_id" not in df.columns:
+        return {}
+    groups = df.groupby("question_id", observed=True, sort=False).indices
+    return {str(qid): np.asarray(pos, dtype=np.int64) for qid, pos in groups.items()}
+
+def _has_date_index(df: pd.DataFrame) -> bool:
+    return "date_of_response" in df.columns and pd.api.types.is_datetime64_dtype(df["date_of_response"].dtype)
+
+def _build_date_index(df: pd.DataFrame, qindex: Dict[str, np.ndarray]) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+    """"" (CUBE todo) e cada question_id -> (datas em ordem crescente, posições das linhas), sem NaT.
+       Um período vira uma fatia por `searchsorted` em vez de uma varredura da coluna."""
+    if df.empty or not _has_date_index(df):
+        return {}
+    dates = df["date_of_response"].to_numpy()
+
+    def _sorted(pos: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        d = dates[pos]
+        order = np.argsort(d, kind="stable")  # NaT vai para o fim
+        d, pos = d[order], pos[order]
+        n = len(d) - int(np.isnat(d).sum())
+        return d[:n], pos[:n]
+
+    out = {"": _sorted(np.arange(len(df), dtype=np.int64))}
+    out.update({qid: _sorted(pos) for qid, pos in qindex.items()})
+    return out
+
+def period_codes(cube: dict, gran: str) -> Tuple[Optional[np.ndarray], Optional[pd.PeriodIndex]]:
+    """(código do período de cada linha (-1 = sem data), períodos ordenados) na granularidade `gran`
+       ("D"/"W"/"M"...). Calculado uma vez por data distinta na 1ª chamada e guardado na entrada do DF_CACHE."""
+    cached = cube.get("periods", {}).get(gran)
+    if cached is not None:
+        return cached
+    df = cube["df"]
+    if df.empty or not _has_date_index(df):
+        return None, None
+    codes, uniq = pd.factorize(df["date_of_response"])
+    per = pd.DatetimeIndex(uniq).to_period(gran)
+    cats = per.unique().sort_values()
+    ucodes = cats.get_indexer(per)
+    pcodes = np.where(codes >= 0, ucodes.take(codes, mode="clip"), -1).astype(np.int32) if len(uniq) else codes.astype(np.int32)
+    _cube_attach(cube, "periods", {**cube.get("periods", {}), gran: (pcodes, cats)})
+    return pcodes, cats
+
+def _build_token_index(df: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """Palavras (sem stopwords) da coluna answer, tokenizadas uma vez por resposta distinta:
+       "rows" = resposta distinta de cada linha (-1 = vazia), "indptr"/"ids" = ids das palavras de cada
+       resposta distinta (CSR) e "vocab" = texto de cada id. Ver top_tokens."""
+    if df.empty or "answer" not in df.columns:
+        return {}
+    codes, uniq = pd.factorize(df["answer"])
+    vocab: Dict[str, int] = {}
+    indptr, ids = [0], []
+    for text in uniq:
+        for t in _TOKEN_RX.findall(str(text).lower()):
+            if t not in TOKEN_STOPWORDS:
+                ids.append(vocab.setdefault(t, len(vocab)))
+        indptr.append(len(ids))
+    return {"rows": codes.astype(np.int32), "indptr": np.asarray(indptr, dtype=np.int64),
+            "ids": np.asarray(ids, dtype=np.int32), "vocab": np.array(list(vocab), dtype=object)}
+
+def _build_sentiment_codes(df: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """"codes" = sentimento de cada linha como inteiro (-1 = vazio), "labels" = rótulo normalizado de
+       cada código, em ordem alfabética. Ver sentiment_counts / sentiment_period_counts."""
+    if "sentiment" not in df.columns:
+        return {}
+    codes, uniq = pd.factorize(df["sentiment"])
+    label_codes, labels = pd.factorize(coerce_sentiment_series(pd.Series(np.asarray(uniq, dtype=object))), sort=True)
+    codes = np.where(codes >= 0, label_codes.take(codes), -1) if len(uniq) else codes
+    return {"codes": codes.astype(np.int16), "labels": np.asarray(labels, dtype=object)}
+
+def _cube_entry(df: pd.DataFrame, etag: Optional[str]) -> dict:
+    qindex = _build_question_index(df)
+    sent = _build_sentiment_codes(df)
+    return {"df": df, "etag": etag, "checked_at": time.time(), "qindex": qindex,
+            "qaggs": _build_question_aggregates(df, qindex, sent), "dindex": _build_date_index(df, qindex),
+            "sentiment": sent, "version": next(_CUBE_VERSIONS)}
+
+def question_positions(cube: dict, qid) -> Optional[np.ndarray]:
+    """Posições das linhas da pergunta (vazio se não existir); sem `qid`, None = todas as linhas."""
+    if not qid:
+        return None
+    return cube["qindex"].get(str(qid), np.empty(0, dtype=np.int64))
+
+def date_window_positions(cube: dict, qid, ds, de) -> Optional[np.ndarray]:
+    """Posições da pergunta (ou do CUBE, sem `qid`) com date_of_response em [ds, de], em ordem original.
+       Usa o índice de datas do CUBE (searchsorted); sem período devolve `question_positions`."""
+    if not (ds and de):
+        return question_positions(cube, qid)
+    idx = cube.get("dindex", {}).get(str(qid) if qid else "")
+    if idx is None:
+        return select_rows(cube["df"], question_positions(cube, qid), date_range=(ds, de))
+    dates, pos = idx
+    lo = dates.searchsorted(pd.Timestamp(ds).to_datetime64(), side="left")
+    hi = dates.searchsorted(pd.Timestamp(de).to_datetime64(), side="right")
+    return np.sort(pos[lo:hi])
+
+# ---------- Recortes sem cópia: posições de linha -> só as colunas usadas ----------
+# O DF do CUBE é compartilhado entre callbacks e threads: os recortes são feitos sobre
+# posições (np.ndarray) e só no fim `take_rows` materializa as linhas/colunas que o callback usa.
+def select_rows(df: pd.DataFrame, pos: Optional[np.ndarray] = None, date_range: Optional[tuple] = None,
+                isin: Optional[Dict[str, list]] = None, equals: Optional[Dict[str, object]] = None) -> Optional[np.ndarray]:
+    """Posições de `df` (partindo de `pos`; None = todas) que passam nos filtros:
+       `date_range` = (início, fim) inclusivo em date_of_response (só com os dois lados),
+       `isin` = {coluna: valores} e `equals` = {coluna: valor}, comparando como texto.
+       Filtros vazios ou em colunas inexistentes são ignorados. Devolve None se nada filtrou."""
+    conds = []
+    if date_range and all(date_range) and "date_of_response" in df.columns:
+        ds, de = date_range
+        conds.append(("date_of_response", lambda s: (s >= ds) & (s <= de)))
+    for col, vals in (isin or {}).items():
+        if col in df.columns and vals:
+            wanted = [str(v) for v in (vals if isinstance(vals, list) else [vals])]
+            conds.append((col, lambda s, wanted=wanted: str_isin_mask(s, wanted)))
+    for col, val in (equals or {}).items():
+        if col in df.columns and val:
+            conds.append((col, lambda s, wanted=[str(val)]: str_isin_mask(s, wanted)))
+
+    for col, cond in conds:
+        s = df[col] if pos is None else df[col].take(pos)
+        m = np.asarray(cond(s), dtype=bool)
+        pos = np.flatnonzero(m) if pos is None else pos[m]
+    return pos
+
+def take_rows(df: pd.DataFrame, pos: Optional[np.ndarray], cols: Optional[List[str]] = None) -> pd.DataFrame:
+    """Materializa o recorte com uma única cópia: linhas em `pos` e só as colunas `cols` que existirem.
+       Sem filtro de linhas (pos=None) devolve o próprio `df` — somente leitura para quem chama."""
+    if pos is None:
+        return df
+    if cols is None:
+        return df.take(pos)
+    idx = [df.columns.get_loc(c) for c in dict.fromkeys(cols) if c in df.columns]
+    return df.iloc[pos, idx]
+
+def _refresh_cube(env_resolved: str, key: str) -> None:
+    """Revalida o CUBE no S3 e, se mudou, troca a entrada do DF_CACHE de uma vez só."""
+    k = (env_resolved, key)
+    try:
+        entry = DF_CACHE.peek(k)
+        if entry is None:
+            return
+        with _file_lock(_cube_lock_path(key)):
+            src = _s3_find_cube(env_resolved, key)
+            if src is None or src["etag"] == entry.get("etag"):
+                entry["checked_at"] = time.time()
+                return
+            local_path = _s3_download_to_tmp(env_resolved, key, src["uri"], progress=False)
+            if not local_path:
+                raise RuntimeError(f"download de {src['uri']} falhou")
+            etag = src["etag"]
+            # o novo CUBE é montado com o antigo ainda no cache (~2x a memória); se os dois não cabem no
+            # orçamento, o antigo sai antes (quem pedir nesse meio tempo espera o lock e lê o Parquet novo)
+            old_bytes = DF_CACHE.size_of(k)
+            if 2 * old_bytes > DF_CACHE.max_bytes:
+                DF_CACHE.pop(k)
+                entry = None  # solta a última referência deste thread ao DF antigo
+                print(f"[CACHE] CUBE antigo descartado antes do refresh env={env_resolved} key={key} "
+                      f"({old_bytes} bytes; orçamento {DF_CACHE.max_bytes})")
+            df = _build_cube_from_file(local_path)
+            _write_parquet_cache(df, env_resolved, key, etag)
+        DF_CACHE[k] = _cube_entry(df, etag)
+        FIGURE_CACHE.pop_where(lambda fk: fk[:2] == k)
+        PIVOT_CACHE.pop_where(lambda pk: pk[:2] == k)
+        with _PIVOT_DIMS_LOCK:
+            for base in [b for b in _PIVOT_DIMS if b[:2] == k]:
+                del _PIVOT_DIMS[base]
+        print(f"[CACHE] CUBE atualizado para env={env_resolved} key={key} | etag={etag} | linhas={len(df)}")
+    except Exception as e:
+        print(f"[CACHE] Falha ao atualizar CUBE env={env_resolved} key={key}: {e}")
+        entry = DF_CACHE.peek(k)
+        if entry is not None:
+            entry["checked_at"] = time.time()
+    finally:
+        with _REFRESH_LOCK:
+            _REFRESHING.discard(k)
+
+def _schedule_refresh(env_resolved: str, key: str, entry: dict) -> None:
+    """Dispara a revalidação em background quando o TTL expira; quem chama segue com o DF atual."""
+    if DF_CACHE_TTL_SECONDS <= 0 or time.time() - entry["checked_at"] < DF_CACHE_TTL_SECONDS:
+        return
+    k = (env_resolved, key)
+    with _REFRESH_LOCK:
+        if k in _REFRESHING:
+            return
+        _REFRESHING.add(k)
+    threading.Thread(target=_refresh_cube, args=k, name=f"cube-refresh-{key}", daemon=True).start()
+
+def _single_flight(k: Tuple[str, str], loader):
+    """Executa `loader` uma única vez por chave; chamadas concorrentes recebem o mesmo resultado (ou erro)."""
+    with _INFLIGHT_LOCK:
+        fut = _INFLIGHT.get(k)
+        leader = fut is None
+        if leader:
+            fut = _INFLIGHT[k] = Future()
+    if leader:
+        try:
+            fut.set_result(loader())
+        except BaseException as e:
+            fut.set_exception(e)
+        finally:
+            with _INFLIGHT_LOCK:
+                _INFLIGHT.pop(k, None)
+    return fut.result()
+
+def _load_cube(env_resolved: str, key: str) -> dict:
+    """Carrega o CUBE do Parquet local ou do S3 e registra no DF_CACHE.
+       O lock de arquivo serializa os workers: quem chega depois reaproveita o Parquet recém-gravado."""
+    k = (env_resolved, key)
+    entry = DF_CACHE.peek(k)
+    if entry is not None:
+        return entry
+
+    _set_load_progress(env_resolved, key, "start")  # descarta o registro de uma carga anterior
+    try:
+        src, lookup_error = _s3_find_cube(env_resolved, key), None
+    except Exception as e:  # consulta falhou (throttling, timeout, permissão): não é "CUBE inexistente"
+        src, lookup_error = None, e
+        print(f"[S3] Falha ao localizar o CUBE env={env_resolved} key={key}: {e}")
+    etag = src["etag"] if src else None
+    try:
+        with _file_lock(_cube_lock_path(key)):
+            df = _read_parquet_cache(env_resolved, key, etag)
+            if df is None and src and CUBE_STREAM_PARSE and src["ext"] != ".parquet":  # Parquet precisa do rodapé
+                df, stream_etag = _s3_stream_cube(env_resolved, key, src["uri"])
+                if df is not None:
+                    etag = stream_etag
+                    _write_parquet_cache(df, env_resolved, key, etag)
+            if df is None:
+                local_path = _s3_download_to_tmp(env_resolved, key, src["uri"]) if src else None
+                if not local_path or not os.path.exists(local_path):
+                    fallback_path = f"{key}_analytics_cube.csv"
+                    print(f"Download do S3 falhou. Tentando fallback local: {fallback_path}")
+                    if os.path.exists(fallback_path):
+                        local_path = fallback_path
+                        etag = None  # arquivo local não corresponde ao ETag do S3
+                    elif src is None and lookup_error is None:
+                        # só uma consulta bem-sucedida sem nenhuma variante vai para o cache negativo
+                        msg = f"Cubo de dados não encontrado para key='{key}' no ambiente='{env_resolved}'"
+                        MISSING_CUBES.add(k, msg)
+                        raise FileNotFoundError(msg)
+                    else:
+                        raise RuntimeError(f"Falha ao obter o CUBE para key='{key}' no ambiente='{env_resolved}': "
+                                           f"{lookup_error or 'download falhou'}")
+
+                _set_load_progress(env_resolved, key, "parse")
+                df = _build_cube_from_file(local_path)
+                _write_parquet_cache(df, env_resolved, key, etag)
+
+        entry = _cube_entry(df, etag)
+    except Exception:
+        _set_load_progress(env_resolved, key, "error")
+        raise
+    DF_CACHE[k] = entry
+    _set_load_progress(env_resolved, key, "ready")
+    return entry
+
+def load_cube_for_key(env_resolved: str, key: str) -> dict:
+    """Entrada do cache para (env, key): DF do CUBE + índices derivados (ver DF_CACHE)."""
+    k = (env_resolved, key)
+    entry = DF_CACHE.get(k)
+    if entry is not None:
+        _schedule_refresh(env_resolved, key, entry)
+        return entry
+    missing = MISSING_CUBES.get(k)
+    if missing is not None:
+        raise FileNotFoundError(missing)
+    return _single_flight(k, lambda: _load_cube(env_resolved, key))
+
+def load_df_for_key(env_resolved: str, key: str) -> pd.DataFrame:
+    """Carrega DF do CUBE para (env, key) com cache em memória, cache Parquet local e download do S3 se necessário."""
+    return load_cube_for_key(env_resolved, key)["df"]
+
+def _cube_version(env_resolved: str, key: str) -> Optional[int]:
+    entry = DF_CACHE.peek((env_resolved, key))
+    return entry.get("version") if entry is not None else None
+
+def _meta_marker(env_resolved: str, key: str) -> str:
+    """Se os metadados do questionário estão no QUESTION_META_CACHE: sem eles os tipos vêm da heurística."""
+    return "meta" if QUESTION_META_CACHE.peek((env_resolved, key)) is not None else "heuristic"
+
+def memoize_figures(name: str):
+    """Memoiza callbacks de gráfico cujos dois últimos argumentos são (key, env_resolved).
+       Guarda as saídas serializadas em JSON no FIGURE_CACHE; a versão do CUBE na chave garante
+       que nada calculado sobre um CUBE antigo seja servido depois de um refresh, e o marcador de
+       metadados que cards tipados pela heurística sejam refeitos quando o questionário chegar.
+       Saídas provisórias (_error_box, nuvem indisponível; ver _skip_memoize) não são guardadas."""
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args):
+            key = args[-2] or os.getenv("KEY", "")
+            env_resolved = normalize_env(args[-1] or os.getenv("APP_DEFAULT_ENV", "dev"))
+            inputs = json.dumps(args[:-2], sort_keys=True, default=str)
+            version = _cube_version(env_resolved, key)
+            if version is not None:
+                hit = FIGURE_CACHE.get((env_resolved, key, version, _meta_marker(env_resolved, key), name, inputs))
+                if hit is not None and _wordcloud_refs_ok(hit):
+                    return tuple(json.loads(hit))
+            skipped = getattr(_NO_MEMOIZE, "count", 0)
+            out = fn(*args)
+            if getattr(_NO_MEMOIZE, "count", 0) != skipped:
+                return out
+            # só guarda se o CUBE usado é o mesmo antes e depois (sem refresh no meio)
+            if version is None:
+                version = _cube_version(env_resolved, key)
+            if version is not None and version == _cube_version(env_resolved, key):
+                fig_key = (env_resolved, key, version, _meta_marker(env_resolved, key), name, inputs)
+                FIGURE_CACHE[fig_key] = json.dumps(out, cls=PlotlyJSONEncoder)
+            return out
+        return wrapper
+    return deco
+
 # ==============================
 # 5) Funções de Análise e Helpers
 # ==============================
@@ -761,10 +1863,31 @@ def make_minimal(fig: go.Figure) -> go.Figure:
     fig.update_layout(margin=dict(l=10, r=10, t=50, b=10))
     return fig
 
+def str_isin_mask(s: pd.Series, wanted: List[str]) -> np.ndarray:
+    """Máscara de `s.astype(str).isin(wanted)`; em colunas 'category' testa só as categorias e indexa pelos códigos."""
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        lut = np.append(s.cat.categories.astype(str).isin(wanted), "nan" in wanted)  # código -1 (NaN) -> "nan"
+        return lut[s.cat.codes.to_numpy()]
+    return s.astype(str).isin(wanted).to_numpy()
+
+def numeric_values(s: pd.Series) -> pd.Series:
+    """`pd.to_numeric(s, errors="coerce")`; em colunas 'category' converte só as categorias."""
+    if not isinstance(s.dtype, pd.CategoricalDtype):
+        return pd.to_numeric(s, errors="coerce")
+    nums = pd.to_numeric(pd.Series(s.cat.categories.astype(object)), errors="coerce")
+    codes = s.cat.codes.to_numpy()
+    if (codes < 0).any():
+        nums = pd.concat([nums.astype(float), pd.Series([np.nan])], ignore_index=True)  # código -1 -> NaN
+    return pd.Series(nums.to_numpy()[codes], index=s.index, name=s.name)
+
 def high_cardinality(df: pd.DataFrame, col: str, max_ratio: float = 0.2, min_unique: int = 50) -> bool:
     try:
         n = len(df)
-        u = df[col].astype(str).nunique(dropna=True)
+        s = df[col]
+        if isinstance(s.dtype, pd.CategoricalDtype):
+            u = s.nunique(dropna=True) + int(s.isna().any())  # NaN contaria como "nan"
+        else:
+            u = s.astype(str).nunique(dropna=True)
         return (u >= min_unique) and (u / max(1, n) > max_ratio)
     except Exception:
         return True
@@ -811,15 +1934,19 @@ def parse_multi(ans: str) -> List[str]:
     cleaned = re.sub(r"[,/|]", ";", ans)
     return [t.strip() for t in cleaned.split(";") if t.strip()]
 
-def explode_multiple(sub: pd.DataFrame) -> pd.DataFrame:
-    rows = []
-    for _, row in sub.iterrows():
-        items = parse_multi(row.get("answer", ""))
-        for it in items:
-            r = row.copy()
-            r["answer_item"] = it
-            rows.append(r)
-    return pd.DataFrame(rows).reset_index(drop=True) if rows else pd.DataFrame(columns=list(sub.columns) + ["answer_item"])
+def explode_multiple(sub: pd.DataFrame, keep_cols: Optional[List[str]] = None) -> pd.DataFrame:
+    """Uma linha por item marcado (coluna `answer_item`), mesma semântica de `parse_multi`, sem iterrows.
+       `keep_cols` limita as colunas carregadas junto (padrão: todas)."""
+    cols = list(sub.columns) if keep_cols is None else [c for c in keep_cols if c in sub.columns]
+    if sub.empty or "answer" not in sub.columns:
+        return pd.DataFrame(columns=cols + ["answer_item"])
+    # índice posicional: itens explodidos apontam direto para a linha de origem
+    ans = pd.Series(sub["answer"].to_numpy(dtype=object))
+    items = ans.str.split(r"[,;/|]", regex=True).explode().str.strip()
+    items = items[items.notna() & items.ne("")]
+    out = sub[cols].iloc[items.index.to_numpy()].reset_index(drop=True)
+    out["answer_item"] = items.to_numpy()
+    return out
 
 def _clean_series_for_counts(s: pd.Series) -> pd.Series:
     # mantém o comprimento; apenas normaliza e marca inválidos como NaN
@@ -850,6 +1977,129 @@ def make_pv_answer(df_q: pd.DataFrame, bins: int = 10) -> pd.DataFrame:
         out = out.dropna(subset=["__pv_answer__"])
     return out
 
+# ---------- Pool de processos para tarefas CPU-bound (nuvem de palavras) ----------
+# Tiram do processo web o trabalho que segura o GIL. As funções executadas no pool ficam em
+# cpu_tasks.py (os filhos importam só esse módulo) e recebem/devolvem só dados simples (dict/list/bytes);
+# figuras e componentes são montados no callback.
+_CPU_POOL: Optional[ProcessPoolExecutor] = None
+_CPU_POOL_LOCK = threading.Lock()
+_CPU_POOL_SLOTS = threading.BoundedSemaphore(max(1, CPU_POOL_MAX_QUEUE))
+
+def _cpu_pool() -> ProcessPoolExecutor:
+    global _CPU_POOL
+    with _CPU_POOL_LOCK:
+        if _CPU_POOL is None:
+            _CPU_POOL = ProcessPoolExecutor(max_workers=CPU_POOL_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _CPU_POOL
+
+def _reset_cpu_pool() -> None:
+    global _CPU_POOL
+    with _CPU_POOL_LOCK:
+        pool, _CPU_POOL = _CPU_POOL, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def run_cpu_task(fn, *args):
+    """Executa `fn(*args)` no pool de processos, com fila limitada (CPU_POOL_MAX_QUEUE) e timeout.
+       Levanta TimeoutError se o pool está saturado ou a tarefa passa de CPU_POOL_TIMEOUT_SECONDS;
+       quem chama decide o placeholder. Com CPU_POOL_WORKERS=0 roda inline."""
+    if CPU_POOL_WORKERS <= 0:
+        return fn(*args)
+    if not _CPU_POOL_SLOTS.acquire(blocking=False):
+        print(f"[CPU] Pool saturado ({CPU_POOL_MAX_QUEUE} tarefas); {fn.__name__} não enfileirada.")
+        raise TimeoutError("pool de CPU saturado")
+    try:
+        fut = _cpu_pool().submit(fn, *args)
+    except Exception:
+        _CPU_POOL_SLOTS.release()
+        _reset_cpu_pool()
+        raise
+    # a vaga só volta quando o worker termina (mesmo que quem pediu já tenha desistido)
+    fut.add_done_callback(lambda _: _CPU_POOL_SLOTS.release())
+    try:
+        return fut.result(timeout=CPU_POOL_TIMEOUT_SECONDS)
+    except TimeoutError:
+        print(f"[CPU] {fn.__name__} passou de {CPU_POOL_TIMEOUT_SECONDS}s; respondendo com placeholder.")
+        raise
+    except BrokenProcessPool:
+        _reset_cpu_pool()
+        raise
+
+def _wordcloud_dir() -> str:
+    path = WORDCLOUD_CACHE_DIR or os.path.join(_data_dir(), "wordclouds")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def _wordcloud_digest(freq: Dict[str, int], width: int, height: int) -> str:
+    # a ordem das frequências entra no hash: o WordCloud desempata por ela
+    payload = json.dumps([WORDCLOUD_RENDER_VERSION, width, height, list(freq.items())], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _prune_wordcloud_dir(directory: str, keep: str) -> None:
+    """Mantém o diretório das nuvens abaixo de WORDCLOUD_CACHE_MAX_BYTES, apagando pelo mtime mais antigo
+       (nunca `keep`, o PNG que acabou de ser gerado)."""
+    if WORDCLOUD_CACHE_MAX_BYTES <= 0:
+        return
+    files = []
+    with os.scandir(directory) as it:
+        for e in it:
+            if e.name.endswith(".png"):
+                try:
+                    st = e.stat()
+                except FileNotFoundError:  # outro worker já apagou
+                    continue
+                files.append((st.st_mtime, st.st_size, e.path))
+    total = sum(size for _, size, _ in files)
+    if total <= WORDCLOUD_CACHE_MAX_BYTES:
+        return
+    removed = 0
+    for _, size, path in sorted(files):
+        if total <= 0.8 * WORDCLOUD_CACHE_MAX_BYTES:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+    print(f"[WORDCLOUD] {removed} PNGs antigos removidos de {directory} (limite {WORDCLOUD_CACHE_MAX_BYTES} bytes)")
+
+_WORDCLOUD_REF_RX = re.compile(r"wordcloud/([0-9a-f]{64})\.png")
+
+def _wordcloud_refs_ok(payload: str) -> bool:
+    """Os PNGs citados numa saída memoizada ainda estão em disco? Marca o uso (mtime) dos que estão;
+       se algum já foi podado por _prune_wordcloud_dir, a saída precisa ser recalculada."""
+    if "wordcloud/" not in payload:
+        return True
+    directory = _wordcloud_dir()
+    for digest in set(_WORDCLOUD_REF_RX.findall(payload)):
+        try:
+            os.utime(os.path.join(directory, f"{digest}.png"))
+        except FileNotFoundError:
+            return False
+    return True
+
+def wordcloud_png_path(freq: Dict[str, int], width: int, height: int) -> Tuple[str, str]:
+    """(hash, caminho) do PNG da nuvem; renderiza no pool de CPU só se ainda não existe em disco.
+       O mtime marca o último uso: é por ele que _prune_wordcloud_dir escolhe o que apagar."""
+    digest = _wordcloud_digest(freq, width, height)
+    directory = _wordcloud_dir()
+    path = os.path.join(directory, f"{digest}.png")
+    try:
+        os.utime(path)
+        return digest, path
+    except FileNotFoundError:
+        pass
+    png = run_cpu_task(cpu_tasks.wordcloud_png, freq, width, height)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(png)
+    os.replace(tmp_path, path)
+    _prune_wordcloud_dir(directory, path)
+    return digest, path
+
 def build_topics_wordcloud_component(d: pd.DataFrame, width: int = 900, height: int = 520):
     if not HAS_WORDCLOUD: return html.Div("Para a nuvem, instale: pip install wordcloud pillow")
     if d.empty or "topic" not in d.columns: return html.Div("Sem tópicos na seleção atual.")
@@ -858,10 +2108,13 @@ def build_topics_wordcloud_component(d: pd.DataFrame, width: int = 900, height:
     if s.empty: return html.Div("Sem tópicos válidos para gerar a nuvem.")
     freq = s.value_counts()
     if freq.empty: return html.Div("Sem tópicos válidos para gerar a nuvem.")
-    wc = WordCloud(width=width, height=height, background_color="white", colormap="tab20c", prefer_horizontal=0.95, random_state=42, collocations=False, normalize_plurals=True, max_words=200, min_font_size=10, stopwords=STOPWORDS).generate_from_frequencies(freq.to_dict())
-    buf = io.BytesIO(); wc.to_image().save(buf, format="PNG", optimize=True)
-    b64 = base64.b64encode(buf.getvalue()).decode("utf-8")
-    return html.Img(src=f"data:image/png;base64,{b64}", style={"width":"100%","height":"auto"})
+    try:
+        digest, _ = wordcloud_png_path({k: int(v) for k, v in freq.items()}, width, height)
+    except (TimeoutError, BrokenProcessPool):
+        _skip_memoize()  # provisório: a próxima chamada tenta renderizar de novo
+        return html.Div("Nuvem indisponível no momento (servidor ocupado). Tente novamente em instantes.", className="text-muted")
+    # a resposta do callback leva só a URL; o PNG vem da rota /wordcloud (cacheável pelo navegador)
+    return html.Img(src=f"{BASE_PATH}wordcloud/{digest}.png", style={"width":"100%","height":"auto"})
 
 def responsive_axis(fig: go.Figure, labels=None, axis: str = "x"):
     n = len(labels) if labels is not None else 0
@@ -887,22 +2140,11 @@ def _extract_click_label(clickData):
     p = clickData["points"][0]
     return p.get("label", p.get("x"))
 
-def _apply_qfilter(sub: pd.DataFrame, qfilter: Dict[str, Optional[str]]) -> pd.DataFrame:
-    qfilter = qfilter or {}
-    if qfilter.get("category"): sub = sub[sub["category"].astype(str) == str(qfilter["category"])]
-    if qfilter.get("topic"): sub = sub[sub["topic"].astype(str) == str(qfilter["topic"])]
-    return sub
-
-def sentiment_timeline(df: pd.DataFrame, granularity: str) -> Optional[go.Figure]:
-    if df.empty or "sentiment" not in df.columns or "date_of_response" not in df.columns:
-        return None
-    d = df.dropna(subset=["date_of_response", "sentiment"]).copy()
-    if d.empty: return None
+def sentiment_timeline(cube: dict, pos: Optional[np.ndarray], granularity: str) -> Optional[go.Figure]:
+    """Tendência de sentimento das linhas `pos` do CUBE (None = todas); ver sentiment_period_counts."""
     gran = (granularity or "W")
-    d["period"] = pd.to_datetime(d["date_of_response"]).dt.to_period(gran)
-    trend = d.groupby(["period","sentiment"]).size().reset_index(name="count")
+    trend = sentiment_period_counts(cube, pos, gran)
     if trend.empty: return None
-    trend = trend.sort_values(["period","sentiment"])
     trend["period_str"] = trend["period"].astype(str)
     period_order = trend["period_str"].drop_duplicates().tolist()
     fig = px.bar(
@@ -976,23 +2218,54 @@ def sentiment_percentages_tuple(df: pd.DataFrame) -> tuple[int, float, float, fl
         return 0, 0.0, 0.0, 0.0, 0.0
     
     s = coerce_sentiment_series(df["sentiment"])
-    total = int(len(s))
-    
+    return _sentiment_tuple_from_counts(s.value_counts(), int(len(s)))
+
+def _sentiment_tuple_from_counts(counts: Optional[pd.Series], total: int) -> tuple[int, float, float, float, float]:
+    """Mesmo resultado de `sentiment_percentages_tuple` a partir das contagens por sentimento normalizado."""
     if total == 0:
         return 0, 0.0, 0.0, 0.0, 0.0
-    
-    pos = int((s == "positivo").sum())
-    neg = int((s == "negativo").sum())
-    neu = int((s == "neutro").sum())
-    nao_aplic = int((s == "não aplicável").sum())
-    
+    counts = counts if counts is not None else pd.Series(dtype="int64")
+    n = lambda label: int(counts.get(label, 0))
     f = lambda x: round(100.0 * x / max(1, total), 1)
-    
-    return total, f(pos), f(neg), f(neu), f(nao_aplic)
+    return total, f(n("positivo")), f(n("negativo")), f(n("neutro")), f(n("não aplicável"))
+
+# ---------- Agregação de sentimento sobre os códigos do CUBE (cards e tendência) ----------
+# `sent` = cube["sentiment"] (ver _build_sentiment_codes); `pos` = posições das linhas (None = todas)
+def sentiment_counts(sent: Dict[str, np.ndarray], pos: Optional[np.ndarray] = None) -> pd.Series:
+    """Linhas por sentimento normalizado, com um único bincount sobre os códigos."""
+    if not sent:
+        return pd.Series(dtype="int64")
+    codes = sent["codes"] if pos is None else sent["codes"][pos]
+    return pd.Series(np.bincount(codes[codes >= 0], minlength=len(sent["labels"])), index=sent["labels"])
+
+def sentiment_period_counts(cube: dict, pos: Optional[np.ndarray], gran: str) -> pd.DataFrame:
+    """Linhas por (período, sentimento) — colunas period/sentiment/count, ordenadas por período e sentimento —
+       num bincount 2-D sobre (código do período, código do sentimento); mesmos códigos de `sentiment_counts`.
+       Linhas sem data ou sentimento ficam fora."""
+    sent = cube.get("sentiment") or {}
+    pcodes, pcats = period_codes(cube, gran)
+    if not sent or pcodes is None:
+        return pd.DataFrame(columns=["period", "sentiment", "count"])
+    scodes = sent["codes"]
+    if pos is not None:
+        pcodes, scodes = pcodes[pos], scodes[pos]
+    ok = (pcodes >= 0) & (scodes >= 0)
+    n_sent = len(sent["labels"])
+    grid = np.bincount(pcodes[ok].astype(np.int64) * n_sent + scodes[ok],
+                       minlength=len(pcats) * n_sent).reshape(len(pcats), n_sent)
+    pi, si = np.nonzero(grid)
+    return pd.DataFrame({"period": pcats.take(pi), "sentiment": sent["labels"][si], "count": grid[pi, si]})
+
+def sentiment_kpis(sent: Dict[str, np.ndarray], pos: Optional[np.ndarray] = None) -> tuple[int, float, float, float, float]:
+    """(total, %pos, %neg, %neu, %nao_aplicavel) das linhas, como `sentiment_percentages_tuple`."""
+    if not sent:
+        return 0, 0.0, 0.0, 0.0, 0.0
+    total = len(sent["codes"]) if pos is None else len(pos)
+    return _sentiment_tuple_from_counts(sentiment_counts(sent, pos), total)
 
-def render_sentiment_cards(df: pd.DataFrame):
-    # Agora usando a versão com 5 valores que inclui não aplicável
-    total, ppos, pneg, pneu, pna = sentiment_percentages_tuple(df)
+def render_sentiment_cards(df: Optional[pd.DataFrame], percentages: Optional[tuple] = None):
+    # Agora usando a versão com 5 valores que inclui não aplicável (ou os percentuais já agregados)
+    total, ppos, pneg, pneu, pna = percentages if percentages is not None else sentiment_percentages_tuple(df)
     if total == 0:
         return html.Div(className="muted-box", children="Sem dados de sentimento nesta seleção.")
 
@@ -1030,24 +2303,177 @@ def topics_bar_fig(sub_df: pd.DataFrame) -> go.Figure:
     fig.update_traces(texttemplate="%{text:.1f}%")
     return create_fig_style(fig, x="Tópico", y="Qtde", tickangle=-25)
 
-def answers_top_tokens_fig(sub_df: pd.DataFrame, top_n: int = 20) -> Optional[go.Figure]:
-    if sub_df.empty or "answer" not in sub_df.columns: return None
-    s = sub_df["answer"].dropna().astype(str).str.lower()
-    if s.empty: return None
-    tokens, rx = [], re.compile(r"\b[^\W\d_]{3,}\b", flags=re.UNICODE)
-    for text in s: tokens.extend(rx.findall(text))
-    stop = {
-        "que","com","para","uma","numa","não","sim","de","da","do","das","dos","em","no","na","os","as","o","a","e",
-        "é","se","por","um","uns","uma","umas","ao","à","às","aos","foi","ser","esta","este","esse","isso","isto",
-        "tá","está","pra","pro","mais","menos","muito","pouco","the","and","for","with","you","not","are","your",
-        "this","that","was","have","has","had","from","into","about","out","her","his","their","our"
-    }
-    tokens = [t for t in tokens if t not in stop]
-    if not tokens: return None
-    vc = pd.Series(tokens).value_counts().head(top_n)
+TOKEN_STOPWORDS = {
+    "que","com","para","uma","numa","não","sim","de","da","do","das","dos","em","no","na","os","as","o","a","e",
+    "é","se","por","um","uns","uma","umas","ao","à","às","aos","foi","ser","esta","este","esse","isso","isto",
+    "tá","está","pra","pro","mais","menos","muito","pouco","the","and","for","with","you","not","are","your",
+    "this","that","was","have","has","had","from","into","about","out","her","his","their","our"
+}
+_TOKEN_RX = re.compile(r"\b[^\W\d_]{3,}\b", flags=re.UNICODE)
+
+def top_tokens(cube: dict, pos: Optional[np.ndarray] = None, top_n: int = 20) -> pd.Series:
+    """Palavras mais frequentes nas linhas `pos` do CUBE (None = todas), pelo índice de palavras do CUBE
+       (montado na 1ª chamada e guardado na entrada do DF_CACHE): linhas por resposta distinta (bincount)
+       -> ocorrências por palavra (bincount ponderado), sem tokenizar de novo."""
+    tix = cube.get("tokens")
+    if tix is None:
+        tix = _cube_attach(cube, "tokens", _build_token_index(cube["df"]))
+    if not tix or not len(tix["ids"]):
+        return pd.Series(dtype="int64")
+    rows = tix["rows"] if pos is None else tix["rows"][pos]
+    per_text = np.bincount(rows[rows >= 0], minlength=len(tix["indptr"]) - 1)
+    counts = np.bincount(tix["ids"], weights=np.repeat(per_text, np.diff(tix["indptr"])),
+                         minlength=len(tix["vocab"])).astype(np.int64)
+    hit = np.flatnonzero(counts)
+    top = hit[np.argsort(-counts[hit], kind="stable")[:top_n]]  # empate: ordem de 1ª ocorrência no CUBE
+    return pd.Series(counts[top], index=tix["vocab"][top])
+
+def answers_top_tokens_fig(cube: dict, pos: Optional[np.ndarray] = None, top_n: int = 20) -> Optional[go.Figure]:
+    vc = top_tokens(cube, pos, top_n)
+    if vc.empty: return None
     fig = px.bar(x=vc.index, y=vc.values, title="Palavras mais frequentes (campo aberto)")
     return create_fig_style(fig, x="Palavra", y="Ocorrências", tickangle=-25)
 
+# ---------- Agregados por pergunta (cards da aba "Análise por Pergunta") ----------
+# Acima disso (texto livre) as contagens por resposta não entram no pré-cálculo do load
+AGG_MAX_UNIQUE_ANSWERS = int(os.getenv("AGG_MAX_UNIQUE_ANSWERS", "500"))
+ANSWER_SOURCE_COLS = ["answer", "orig_answer", "option", "choice", "resposta", "category"]
+AGG_SOURCE_COLS = ANSWER_SOURCE_COLS + ["sentiment"]
+# Colunas que o card de uma pergunta lê quando o recorte é calculado na hora
+QUESTION_CARD_COLS = AGG_SOURCE_COLS + ["topic"]
+
+def _option_counts(raw_counts: pd.Series, top_n: int = 20) -> pd.Series:
+    """Ocorrências por opção de múltipla escolha a partir das contagens por resposta distinta."""
+    if raw_counts.empty:
+        return pd.Series(dtype="int64")
+    exploded = explode_multiple(pd.DataFrame({"answer": raw_counts.index, "__n__": raw_counts.to_numpy()}),
+                                keep_cols=["__n__"])
+    if exploded.empty:
+        return pd.Series(dtype="int64")
+    exploded["answer_item"] = exploded["answer_item"].astype(str)
+    exploded = exploded[_non_empty_mask(exploded["answer_item"])]
+    counts = exploded.groupby("answer_item", sort=False)["__n__"].sum()
+    return counts.sort_values(ascending=False, kind="stable").head(top_n).astype("int64")
+
+def _numeric_hist(raw_counts: pd.Series, bins: int = 20) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """Histograma (contagens, bordas) das respostas numéricas, ponderado pelas contagens por valor."""
+    vals = pd.to_numeric(pd.Series(raw_counts.index, dtype=object), errors="coerce").to_numpy(dtype=float)
+    ok = ~np.isnan(vals)
+    if not ok.any():
+        return None
+    counts, edges = np.histogram(vals[ok], bins=bins, weights=raw_counts.to_numpy()[ok])
+    return counts.astype("int64"), edges
+
+def _category_counts(sub: pd.DataFrame, top_n: int = 30) -> pd.Series:
+    s_cat = sub["category"].dropna().astype(str).str.strip() if "category" in sub.columns else pd.Series([], dtype=str)
+    s_cat = s_cat[s_cat.ne("") & ~s_cat.str.lower().isin({"nan", "none", "null"})]
+    return s_cat.value_counts().head(top_n)
+
+def _clean_category_values(u: pd.Series) -> pd.Series:
+    s = u.astype(str).str.strip()
+    return s.where(s.ne("") & ~s.str.lower().isin({"nan", "none", "null"}), None)
+
+def _per_question_counts(df: pd.DataFrame, col: str, fn) -> Dict[str, pd.Series]:
+    """question_id -> contagem dos valores de `col` (normalizados por `fn`, None = descartado), numa
+       única passada de group-by sobre o CUBE; cada Series mantém a ordem de primeira ocorrência."""
+    if col not in df.columns or "question_id" not in df.columns:
+        return {}
+    keyed = pd.DataFrame({"question_id": df["question_id"], col: _map_uniques(df[col], fn)})
+    counts = keyed.groupby(["question_id", col], observed=True, sort=False).size().rename("count")
+    return {str(qid): s.droplevel(0) for qid, s in counts.groupby(level=0, observed=True, sort=False)}
+
+def question_aggregates(sub: pd.DataFrame, qtype: Optional[str] = None, open_ended: bool = True,
+                        sentiment: Optional[tuple] = None) -> dict:
+    """Agregados que alimentam o card de uma pergunta (contagens por opção/categoria, sentimento, histograma).
+       Sem `qtype` calcula tudo (pré-cálculo no load; partes por resposta só com cardinalidade baixa);
+       com `qtype` calcula apenas o que o tipo de pergunta exibe. `open_ended=False` pula categorias e
+       sentimento (no load elas saem de um group-by único, ver _build_question_aggregates).
+       `sentiment` = KPIs já calculados sobre os códigos do CUBE (ver sentiment_kpis)."""
+    def want(*types) -> bool:
+        return qtype is None or qtype in types
+
+    aggs = {"n": len(sub)}
+    raw_counts = (sub["answer"].value_counts(sort=False, dropna=False)
+                  if "answer" in sub.columns else pd.Series(dtype="int64"))
+    by_answer = qtype is not None or len(raw_counts) <= AGG_MAX_UNIQUE_ANSWERS
+    if by_answer and want("single-choice", "categorical"):
+        s, used_col = _first_nonempty_series(sub, ANSWER_SOURCE_COLS)
+        aggs["answers"], aggs["answers_col"] = s.value_counts(), used_col
+    if by_answer and want("multiple-choice", "multiple"):
+        aggs["options"] = _option_counts(raw_counts)
+    if by_answer and want("numeric"):
+        aggs["hist"] = _numeric_hist(raw_counts)
+    if open_ended and want("open-ended"):
+        aggs["categories"] = _category_counts(sub)
+        aggs["sentiment"] = sentiment if sentiment is not None else sentiment_percentages_tuple(sub)
+    return aggs
+
+def _aggregates_cover(aggs: dict, qtype: Optional[str]) -> bool:
+    """Os agregados guardados têm o que o card desse tipo precisa?"""
+    needed = {"numeric": "hist", "multiple-choice": "options", "multiple": "options",
+              "single-choice": "answers", "categorical": "answers", "open-ended": "categories"}.get(qtype)
+    return needed is None or needed in aggs
+
+def _build_question_aggregates(df: pd.DataFrame, qindex: Dict[str, np.ndarray],
+                               sent: Dict[str, np.ndarray]) -> Dict[str, dict]:
+    """Pré-cálculo no load: agregados sem filtro para todas as perguntas do CUBE.
+       Categorias saem de um group-by único por question_id, sentimento dos códigos do CUBE
+       (`sent`, ver _build_sentiment_codes); as partes que dependem do tipo da resposta, da fatia de cada pergunta."""
+    cols = [c for c in dict.fromkeys(ANSWER_SOURCE_COLS) if c in df.columns]
+    base = df[cols]
+    cats = _per_question_counts(df, "category", _clean_category_values)
+    out = {}
+    for qid, pos in qindex.items():
+        aggs = question_aggregates(base.take(pos), open_ended=False)
+        vc = cats.get(qid)
+        aggs["categories"] = (vc.sort_values(ascending=False).head(30) if vc is not None
+                              else pd.Series(dtype="int64", name="count"))
+        aggs["sentiment"] = _sentiment_tuple_from_counts(sentiment_counts(sent, pos), len(pos))
+        out[qid] = aggs
+    return out
+
+def numeric_hist_fig(hist: Optional[Tuple[np.ndarray, np.ndarray]]) -> go.Figure:
+    if hist is None:
+        fig = go.Figure()
+    else:
+        counts, edges = hist
+        fig = px.bar(x=(edges[:-1] + edges[1:]) / 2, y=counts, title="Distribuição")
+        fig.update_traces(width=np.diff(edges))
+        fig.update_layout(bargap=0)
+    fig = create_fig_style(fig, x="Valor", y="Frequência")
+    fig.update_xaxes(showgrid=False, showticklabels=True)
+    fig.update_yaxes(showgrid=False, showticklabels=True)
+    return fig
+
+def options_bar_fig(vc: Optional[pd.Series], options_order: Optional[List[str]] = None,
+                    top_n: int = 20, category_orders: bool = False) -> go.Figure:
+    """Barras 'Ocorrências por opção' (múltipla escolha e categórica)."""
+    if vc is not None and not vc.empty:
+        if options_order:
+            # respeita opções do questionário, se existirem
+            order = [o for o in options_order if o in vc.index]
+            outros = [o for o in vc.index if o not in order]
+            vc = vc.reindex(order + outros)
+        vc = vc.head(top_n)
+        df_bar = pd.DataFrame({"opcao": vc.index.astype(str), "qtde": vc.values})
+        fig = px.bar(df_bar, x="opcao", y="qtde", title="Ocorrências por opção",
+                     category_orders={"opcao": df_bar["opcao"].tolist()} if category_orders else None)
+        fig.update_traces(text=df_bar["qtde"], textposition="outside", cliponaxis=False)
+        fig = create_fig_style(fig, x="Opção", y="Qtde")
+        fig = responsive_axis(fig, labels=df_bar["opcao"].tolist())
+    else:
+        fig = make_minimal(go.Figure())
+    fig.update_xaxes(showgrid=False, ticks="")
+    fig.update_yaxes(showgrid=False, ticks="", showticklabels=False)
+    return fig
+
+def category_bar_fig(vc: pd.Series) -> go.Figure:
+    df_bar = pd.DataFrame({"Categoria": vc.index.astype(str), "Qtde": vc.values})
+    fig = px.bar(df_bar, x="Categoria", y="Qtde", title="Categorias – Distribuição")
+    fig.update_traces(text=df_bar["Qtde"], textposition="outside", cliponaxis=False)
+    fig = create_fig_style(fig, x="Categoria", y="Qtde")
+    return responsive_axis(fig, labels=df_bar["Categoria"].tolist())
+
 # ==============================
 # 6) Criação do App Dash + CSS
 # ==============================
@@ -1061,7 +2487,7 @@ ASSETS_URL_PATH = BASE_PATH.rstrip("/") + "/assets"
 
 print(f"[BOOT] BASE_PATH={BASE_PATH} | ASSETS_URL_PATH={ASSETS_URL_PATH}")
 
-from flask import Flask
+from flask import Flask, send_file
 from werkzeug.middleware.proxy_fix import ProxyFix
 server = Flask(__name__)
 
@@ -1182,6 +2608,24 @@ def health_root():
 def health_base():
     return {"status": "ok", "service": "dataviz-svc"}, 200
 
+@server.route(BASE_PATH + "wordcloud/<digest>.png")
+def wordcloud_png(digest):
+    # nome = sha256 do conteúdo: o arquivo nunca muda, pode ficar em cache "para sempre"
+    if not re.fullmatch(r"[0-9a-f]{64}", digest):
+        return {"error": "not found"}, 404
+    path = os.path.join(_wordcloud_dir(), f"{digest}.png")
+    if not os.path.exists(path):
+        return {"error": "not found"}, 404
+    resp = send_file(path, mimetype="image/png", etag=digest, max_age=WORDCLOUD_MAX_AGE_SECONDS, conditional=True)
+    resp.cache_control.immutable = True
+    return resp
+
+@server.route(BASE_PATH + "cache-stats")
+def cache_stats():
+    return {"df_cache": DF_CACHE.stats(), "question_meta_cache": QUESTION_META_CACHE.stats(),
+            "figure_cache": FIGURE_CACHE.stats(), "pivot_cache": PIVOT_CACHE.stats(),
+            "missing_cubes": MISSING_CUBES.stats(), "missing_meta": MISSING_META.stats()}, 200
+
 # Navbar
 header = dbc.Navbar()
 
@@ -1205,17 +2649,21 @@ app.layout = dbc.Container([
     dcc.Location(id="url", refresh=False),
     dcc.Store(id="current-env"),
     dcc.Store(id="current-key"),
+    dcc.Interval(id="load-progress-tick", interval=LOAD_PROGRESS_POLL_MS, max_intervals=LOAD_PROGRESS_MAX_POLLS),
     tabs,
+    html.Div(id="load-progress", className="mt-3"),
     html.Div(id="tab-content", className="mt-3"),
 ], fluid=True)
 
 # ==============================
 # 7) UI: Card por Pergunta
 # ==============================
-def question_card(qid: str, qdesc: str, allowed_cols: List[str], df: pd.DataFrame,
-                  env_resolved: str, key: str) -> dbc.Col:
+def question_card(qid: str, qdesc: str, allowed_cols: List[str], cube: dict,
+                  env_resolved: str, key: str, prefill: Optional[tuple] = None) -> dbc.Col:
+    """Card de uma pergunta. `prefill` = saídas de `update_question_graph` já calculadas
+       (modo em lote): o card nasce com os gráficos e o callback não dispara na montagem."""
     try:
-        series = df.loc[df["question_id"].astype(str) == str(qid), "answer"]
+        series = cube["df"]["answer"].take(question_positions(cube, qid))
         qtype_meta = get_qtype_for_question_with_meta(env_resolved, qid, series, key)
     except Exception:
         qtype_meta = None
@@ -1229,6 +2677,10 @@ def question_card(qid: str, qdesc: str, allowed_cols: List[str], df: pd.DataFram
 
     seg_opts = [{"label": c, "value": c} for c in (allowed_cols or [])]
 
+    # valores iniciais: saídas pré-calculadas (modo em lote) ou os padrões do layout
+    pre = lambda i, default: prefill[i] if prefill else default
+    prop = lambda name, i: {name: prefill[i]} if prefill else {}
+
     controls = html.Div([
         html.Div(className="ctrl-grid", children=[
             html.Div([
@@ -1244,6 +2696,8 @@ def question_card(qid: str, qdesc: str, allowed_cols: List[str], df: pd.DataFram
                 html.Label("Valores (opcional)", className="fw-bold"),
                 dcc.Dropdown(
                     id={"type": "q-segvals", "qid": qid},
+                    # mesmo estado que update_seg_values_per_q devolve sem coluna escolhida
+                    options=[], value=None,
                     multi=True,
                     placeholder="Todos os valores",
                     clearable=True,
@@ -1262,7 +2716,7 @@ def question_card(qid: str, qdesc: str, allowed_cols: List[str], df: pd.DataFram
                         html.Strong(str(qid), className="me-2"),
                         dbc.Badge(type_badge[0] + " " + type_badge[2],
                                   color=type_badge[1], className="me-2"),
-                        html.Div(id={"type": "q-filterpill", "qid": qid},
+                        html.Div(id={"type": "q-filterpill", "qid": qid}, children="",
                                  style={"display": "inline-block"}),
                     ], style={"display": "flex", "alignItems": "center", "gap": "8px"}),
                     html.P(qdesc or "", className="text-muted mb-0 mt-2",
@@ -1280,27 +2734,28 @@ def question_card(qid: str, qdesc: str, allowed_cols: List[str], df: pd.DataFram
                 ]),
 
                 dbc.Button("🗑️ Limpar filtros", id={"type":"q-clear","qid": qid}, size="sm", color="secondary", outline=True,
-                        className="mb-3", style={"display": "none"}),
+                        className="mb-3", style=pre(8, {"display": "none"})),
 
                 # ▶️ Cards de sentimento ficam aqui
-                html.Div(id={"type":"q-sentcards","qid": qid}, className="mb-3"),
+                html.Div(id={"type":"q-sentcards","qid": qid}, className="mb-3", **prop("children", 9)),
 
                 # Gráfico principal, que vamos ocultar em perguntas abertas
-                html.Div(id={"type":"q-fig-wrap","qid": qid},
-                        children=dcc.Loading(dcc.Graph(id={"type":"q-fig","qid": qid}, config={"displayModeBar": False}), type="dot")),
+                html.Div(id={"type":"q-fig-wrap","qid": qid}, **prop("style", 1),
+                        children=dcc.Loading(dcc.Graph(id={"type":"q-fig","qid": qid}, config={"displayModeBar": False},
+                                                       **prop("figure", 0)), type="dot")),
 
 
                 dcc.Graph(id={"type": "q-catfig", "qid": qid},
                           config={"displayModeBar": False},
-                          style={"marginTop": "12px"}),
+                          style=pre(5, {"marginTop": "12px"}), **prop("figure", 2)),
 
                 dcc.Graph(id={"type": "q-topicsfig", "qid": qid},
                           config={"displayModeBar": False},
-                          style={"marginTop": "12px"}),
+                          style=pre(6, {"marginTop": "12px"}), **prop("figure", 3)),
 
                 dcc.Graph(id={"type": "q-answers", "qid": qid},
                           config={"displayModeBar": False},
-                          style={"marginTop": "12px", "display": "none"}),
+                          style=pre(7, {"marginTop": "12px", "display": "none"}), **prop("figure", 4)),
             ])
         ], className="mb-4 dash-card"),
         md=6
@@ -1316,7 +2771,100 @@ def to_date_str(x):
         return pd.to_datetime(x, errors="coerce").date().isoformat()
     except Exception:
         return None
- 
+
+# ---------- Motor da pivot: group-bys em cache, sem copiar o CUBE ----------
+# Estatísticas parciais que se recombinam em dimensões mais grossas (soma de somas, mín de mínimos...)
+_PV_PARTIALS = {"sum": "sum", "count": "sum", "min": "min", "max": "max"}
+
+def _pv_group(values: pd.Series, d: pd.DataFrame, dims: List[str], stat: str) -> pd.DataFrame:
+    """Agrupa o recorte `d` por `dims` (mesmas regras de NaN/categorias da pivot_table) sem tocar em `d`."""
+    g = values.groupby([d[c] for c in dims], observed=True, dropna=False, sort=False)
+    if stat == "__count__":
+        out = g.size().to_frame("size")
+    elif stat == "median":
+        out = g.median().to_frame("median")
+    else:
+        out = g.agg(list(_PV_PARTIALS))
+    return out.reset_index()
+
+def _pv_grouped(cube_k: tuple, scope: str, stat: str, dims: List[str], values: pd.Series, d: pd.DataFrame) -> pd.DataFrame:
+    """Group-by do recorte em `dims`: do cache, derivado de um group-by mais fino já em cache, ou calculado."""
+    base = cube_k + (scope, values.name, stat)
+    k = base + (tuple(sorted(dims)),)
+    grouped = PIVOT_CACHE.get(k)
+    if grouped is not None:
+        return grouped
+    if stat != "median":
+        with _PIVOT_DIMS_LOCK:
+            finer = sorted((fd for fd in _PIVOT_DIMS.get(base, ()) if set(dims) < set(fd)), key=len)
+        for finer_dims in finer:
+            src = PIVOT_CACHE.get(base + (finer_dims,))
+            if src is None:  # já saiu do PIVOT_CACHE
+                with _PIVOT_DIMS_LOCK:
+                    _PIVOT_DIMS.get(base, set()).discard(finer_dims)
+                continue
+            parts = {"size": "sum"} if stat == "__count__" else _PV_PARTIALS
+            grouped = (src.groupby(dims, observed=True, dropna=False, sort=False)
+                          .agg(parts).reset_index())
+            break
+    if grouped is None:
+        grouped = _pv_group(values, d, dims, stat)
+    PIVOT_CACHE[k] = grouped
+    with _PIVOT_DIMS_LOCK:
+        _PIVOT_DIMS.setdefault(base, set()).add(k[-1])
+    return grouped
+
+def pivot_table_cached(d: pd.DataFrame, rows: List[str], cols: Optional[str], metric: str, agg: str,
+                       cube_k: tuple, scope: str) -> pd.DataFrame:
+    """Equivale a `pd.pivot_table(d, index=rows, columns=cols, values=metric, aggfunc=agg,
+       fill_value=0, dropna=False)` (com '__count__' = contagem de linhas), mas agrega a partir de
+       group-bys em cache por (recorte, dimensões). `cube_k` = (env, key, versão do CUBE);
+       `scope` identifica o recorte (pergunta, período, filtros). Não altera `d`."""
+    dims = list(dict.fromkeys(rows + ([cols] if cols else [])))
+    if metric != "__count__" and agg not in _PV_PARTIALS and agg not in {"mean", "median"}:
+        # agregado que não sai dos parciais em cache (ex.: nunique): pivot_table direto no recorte,
+        # com as mesmas categorias sem ocorrência podadas do caminho em cache
+        direct = d.assign(**{metric: numeric_values(d[metric])})
+        for c in set(dims) - {"__pv_answer__"}:
+            if isinstance(direct[c].dtype, pd.CategoricalDtype):
+                direct[c] = direct[c].cat.remove_unused_categories()
+        return pd.pivot_table(direct, index=rows, columns=cols, values=metric, aggfunc=agg,
+                              fill_value=0, dropna=False)
+    if metric == "__count__":
+        stat, values = "__count__", pd.Series(1, index=d.index, name="__count__")
+    else:
+        values = numeric_values(d[metric])
+        stat = "median" if agg == "median" else "stats"
+    grouped = _pv_grouped(cube_k, scope, stat, dims, values, d)
+
+    # uma linha por combinação -> a pivot_table só remodela (produto cartesiano, fill 0)
+    if stat == "__count__":
+        val, v = "__count__", grouped["size"]
+    else:
+        val = metric
+        if agg == "median":
+            v = grouped["median"]
+        elif agg == "mean":
+            v = grouped["sum"] / grouped["count"].where(grouped["count"] > 0)
+        else:
+            v = grouped[agg]
+        # a pivot_table devolve inteiros quando a métrica é inteira e o agregado sai exato
+        if pd.api.types.is_integer_dtype(values.dtype) and not pd.api.types.is_integer_dtype(v.dtype) \
+                and np.isfinite(v).all() and (v == np.round(v)).all():
+            v = v.astype(values.dtype)
+    flat = grouped[dims].assign(**{val: v.to_numpy()})
+
+    # categorias do CUBE sem ocorrência no recorte não viram linhas/colunas zeradas
+    # (as faixas de __pv_answer__ vêm do pd.cut e ficam todas)
+    for c in set(dims) - {"__pv_answer__"}:
+        if isinstance(flat[c].dtype, pd.CategoricalDtype):
+            flat[c] = flat[c].cat.remove_unused_categories()
+
+    # `flat` já tem o agregado final, um valor por célula: a pivot_table só remodela. sum/mean/median/min/max
+    # de um valor só devolvem o próprio valor (com os mesmos dtypes da pivot_table original); contagens somam
+    reshape = "sum" if stat == "__count__" or agg == "count" else agg
+    return pd.pivot_table(flat, index=rows, columns=cols, values=val, aggfunc=reshape, fill_value=0, dropna=False)
+
 def pivot_controls(df: pd.DataFrame, state: Dict):
     """UI da aba Pivot – cartões do mesmo tamanho, pergunta1 e sentiment pré-selecionados."""
     if df.empty:
@@ -1326,7 +2874,7 @@ def pivot_controls(df: pd.DataFrame, state: Dict):
     numeric_cols = sorted([
         c for c in df.columns
         if c not in NON_SEGMENTABLE and not is_pii(c)
-        and pd.to_numeric(df[c], errors="coerce").notna().mean() > 0.7
+        and numeric_values(df[c]).notna().mean() > 0.7
     ])
 
     # dimensões seguras
@@ -1548,32 +3096,30 @@ def set_current_key(search):
   Input("current-key","data"),
   Input("current-env","data"),
 )
-
+@memoize_figures("update_pivot")
 def update_pivot(rows, cols, metric, agg, chart, ds, de, pv_qid, pv_use_answer, pv_bins,
                  dim_filter_col, dim_filter_vals, key, env_resolved):
     try:
         key = key or os.getenv("KEY","")
         env_resolved = normalize_env(env_resolved or os.getenv("APP_DEFAULT_ENV","dev"))
 
-        df = load_df_for_key(env_resolved, key) if key else pd.DataFrame()
+        cube = load_cube_for_key(env_resolved, key) if key else None
+        df = cube["df"] if cube else pd.DataFrame()
         if df.empty:
             return empty_state("Sem dados."), go.Figure(), empty_state("Sem dados.")
-        d = df.copy()
-
-        # período
-        if ds and de and "date_of_response" in d.columns:
-            d = d[(d["date_of_response"] >= ds) & (d["date_of_response"] <= de)]
-
         # normaliza seleção
         rows = rows if isinstance(rows, list) else ([rows] if rows else [])
         if not rows:
             return empty_state("Escolha ao menos 1 dimensão em Linhas."), go.Figure(), empty_state("Escolha ao menos 1 dimensão.")
 
+        # recorte (pergunta + período) por posições; sem filtro `d` é o próprio CUBE e nunca é alterado abaixo
+        pos = date_window_positions(cube, pv_qid, ds, de)
+        d = take_rows(df, pos, rows + [cols, metric, dim_filter_col, "answer", "topic"])
+
         # se uma pergunta foi escolhida, restringe DF e (se aplicável) cria __pv_answer__
         base_qtype = None
         wants_answer_dim = pv_use_answer and ("on" in (pv_use_answer or []))
         if pv_qid:
-            d = d[d["question_id"].astype(str) == str(pv_qid)].copy()
             if d.empty:
                 return empty_state("A pergunta selecionada não possui dados no período/recorte atual."), go.Figure(), empty_state("Sem dados para nuvem.")
             base_qtype = get_qtype_for_question_with_meta(env_resolved, pv_qid, d["answer"], key)
@@ -1587,25 +3133,17 @@ def update_pivot(rows, cols, metric, agg, chart, ds, de, pv_qid, pv_use_answer,
         # filtro por dimensão (apenas se a coluna existe após possíveis explodes/cuts)
         if dim_filter_col and dim_filter_vals and dim_filter_col in d.columns:
             chosen = dim_filter_vals if isinstance(dim_filter_vals, list) else [dim_filter_vals]
-            d = d[d[dim_filter_col].astype(str).isin([str(v) for v in chosen])]
+            d = d[str_isin_mask(d[dim_filter_col], [str(v) for v in chosen])]
 
         # garante que __pv_answer__ existe quando solicitado nas dimensões
         if ("__pv_answer__" in rows or cols == "__pv_answer__") and "__pv_answer__" not in d.columns:
             return empty_state("Ative 'Usar respostas como dimensão' e selecione a pergunta."), go.Figure(), empty_state("Selecione a pergunta para a nuvem.")
 
-        # métrica
-        if metric == "__count__":
-            d["__count__"] = 1
-            val, aggfunc = "__count__", "sum"
-        else:
-            d[metric] = pd.to_numeric(d[metric], errors="coerce")
-            val, aggfunc = metric, (agg or "mean")
-
-        # pivot
-        piv = pd.pivot_table(
-            d, index=rows, columns=cols,
-            values=val, aggfunc=aggfunc, fill_value=0, dropna=False
-        )
+        # pivot (group-bys reaproveitados entre trocas de gráfico/colunas; ver pivot_table_cached)
+        scope = json.dumps([pv_qid, ds, de, "__pv_answer__" in d.columns and pv_bins,
+                            dim_filter_col in d.columns and dim_filter_col, dim_filter_vals], default=str)
+        piv = pivot_table_cached(d, rows, cols, metric, agg or "mean",
+                                 (env_resolved, key, cube.get("version")), scope)
 
         # >>> RENOMEIA COLUNAS SÓ PARA EXIBIÇÃO
         piv_disp = (
@@ -1695,17 +3233,16 @@ def sync_dim_filter_values(dim_col, pv_qid, pv_use_answer, pv_bins, ds, de, key,
     key = key or os.getenv("KEY","")
     env_resolved = normalize_env(env_resolved or "dev")
 
-    df = load_df_for_key(env_resolved, key) if key else pd.DataFrame()
+    cube = load_cube_for_key(env_resolved, key) if key else None
+    df = cube["df"] if cube else pd.DataFrame()
 
     if not dim_col or df.empty:
         return [], None
 
-    d = df.copy()
-    if ds and de and "date_of_response" in d.columns:
-        d = d[(d["date_of_response"] >= ds) & (d["date_of_response"] <= de)]
+    pos = date_window_positions(cube, pv_qid, ds, de)
+    d = take_rows(df, pos, [dim_col, "answer"])
 
     if pv_qid:
-        d = d[d["question_id"].astype(str) == str(pv_qid)].copy()
         qtype = analyze_qtype(d["answer"]) if not d.empty else None
         wants_answer_dim = pv_use_answer and ("on" in (pv_use_answer or []))
         if wants_answer_dim and qtype != "text":
@@ -1730,6 +3267,40 @@ def sync_dim_filter_values(dim_col, pv_qid, pv_use_answer, pv_bins, ds, de, key,
 # ==============================
 # 11) Renderização das Abas
 # ==============================
+@dash.callback(
+    Output("load-progress", "children"),
+    Output("load-progress-tick", "disabled"),
+    Input("load-progress-tick", "n_intervals"),
+    Input("current-key", "data"),
+    Input("current-env", "data"),
+)
+def update_load_progress(_n, key, env_resolved):
+    """Barra de progresso enquanto o CUBE é baixado/processado (render_tab fica esperando o carregamento)."""
+    key = key or os.getenv("KEY", "")
+    env_resolved = normalize_env(env_resolved or "dev")
+    k = (env_resolved, key)
+    if not key or DF_CACHE.peek(k) is not None or MISSING_CUBES.get(k) is not None:
+        return None, True
+    rec = load_progress(env_resolved, key) or {}
+    if rec.get("stage") in ("ready", "error"):
+        # na montagem o registro pode ser de uma carga anterior; só um tick confirma que esta terminou
+        ticked = dash.callback_context.triggered[0]["prop_id"].startswith("load-progress-tick")
+        return None, ticked
+    if rec.get("stage") == "download":
+        done, total = rec.get("bytes_done", 0), rec.get("bytes_total", 0)
+        pct = 100.0 * done / total if total else 0.0
+        label = f"Baixando dados… {done / 1e6:.1f} de {total / 1e6:.1f} MB"
+        return html.Div([
+            dbc.Progress(value=pct, label=f"{pct:.0f}%", striped=True, animated=True, className="mb-1"),
+            html.Small(label, className="text-muted"),
+        ]), False
+    if rec.get("stage") == "parse":
+        return html.Div([
+            dbc.Progress(value=100, striped=True, animated=True, className="mb-1"),
+            html.Small("Processando dados…", className="text-muted"),
+        ]), False
+    return None, False
+
 @dash.callback(
     Output("tab-content", "children"),
     Input("main-tabs", "active_tab"),
@@ -1743,30 +3314,28 @@ def render_tab(active, key, env_resolved):
         env_resolved = normalize_env(env_resolved or "dev")
 
         try:
-            df = load_df_for_key(env_resolved, key) if key else pd.DataFrame()
+            cube = load_cube_for_key(env_resolved, key) if key else None
+            df = cube["df"] if cube else pd.DataFrame()
         except Exception as e:
             msg = f"Erro ao carregar CUBE para env={env_resolved} key={key}: {e}"
             print("[render_tab]", msg)
             return html.Div(msg, className="alert alert-danger")
 
-        state = build_state(df, env_resolved=env_resolved, key=key)
+        state = cube_state(cube, env_resolved, key) if cube else build_state(df)
 
         if df.empty:
             return html.Div("Estamos aguardando dados para gerar insights sobre seu caso de uso...", className="alert alert-warning")
 
         if active == "questions":
-            cards = [
-                question_card(
-                    r["question_id"],
-                    r["question_description"],
-                    state["ALLOWED_SEGMENT_COLS"],
-                    df,
-                    env_resolved,
-                    key
-                )
-                for _, r in state["questions_df"].iterrows()
-            ]
-            return dbc.Row(cards) if cards else empty_state("Sem perguntas para exibir.")
+            # cards paginados: só a página visível é montada (ver render_question_page)
+            n = len(state["questions_df"])
+            if not n:
+                return empty_state("Sem perguntas para exibir.")
+            pages = -(-n // QUESTIONS_PAGE_SIZE) if QUESTIONS_PAGE_SIZE > 0 else 1
+            pagination = dbc.Pagination(id="q-pagination", max_value=pages, active_page=1,
+                                        fully_expanded=False, previous_next=True, className="mb-3",
+                                        style={} if pages > 1 else {"display": "none"})
+            return html.Div([pagination, html.Div(id="q-page")])
 
         if active == "pivot":
             try:
@@ -1795,6 +3364,44 @@ def render_tab(active, key, env_resolved):
         return _error_box("Erro no callback render_tab", e)
 
 
+@dash.callback(
+    Output("q-page", "children"),
+    Input("q-pagination", "active_page"),
+    State("current-key", "data"),
+    State("current-env", "data"),
+)
+def render_question_page(page, key, env_resolved):
+    try:
+        key = key or os.getenv("KEY", "")
+        env_resolved = normalize_env(env_resolved or "dev")
+        cube = load_cube_for_key(env_resolved, key) if key else None
+        if not cube:
+            return empty_state("Sem perguntas para exibir.")
+        state = cube_state(cube, env_resolved, key)
+
+        qdf = state["questions_df"]
+        if QUESTIONS_PAGE_SIZE > 0:
+            start = (max(1, int(page or 1)) - 1) * QUESTIONS_PAGE_SIZE
+            qdf = qdf.iloc[start:start + QUESTIONS_PAGE_SIZE]
+        cards = [
+            question_card(
+                r["question_id"],
+                r["question_description"],
+                state["ALLOWED_SEGMENT_COLS"],
+                cube,
+                env_resolved,
+                key,
+                prefill=question_card_outputs(r["question_id"], key, env_resolved) if QUESTIONS_BATCH_MODE else None
+            )
+            for _, r in qdf.iterrows()
+        ]
+        return dbc.Row(cards) if cards else empty_state("Sem perguntas para exibir.")
+
+    except Exception as e:
+        app.server.logger.exception("Erro no callback render_question_page")
+        return _error_box("Erro no callback render_question_page", e)
+
+
 # ==============================
 # 12) Callbacks de UX e Drill por Pergunta
 # ==============================
@@ -1815,6 +3422,8 @@ def toggle_collapse(n, is_open):
     Input({"type":"q-segcol","qid":MATCH}, "value"),
     Input("current-key","data"),
     Input("current-env","data"),
+    # no modo em lote o card já nasce com o dropdown vazio (ver question_card) e nada dispara na montagem
+    prevent_initial_call=QUESTIONS_BATCH_MODE,
 )
 def update_seg_values_per_q(seg_col, key, env_resolved):
     key = key or os.getenv("KEY","")
@@ -1913,8 +3522,10 @@ def update_drill_state(main_click, cat_click, clear_clicks, curr, fig_id):
     State({"type":"q-fig","qid":MATCH}, "id"),
     Input("current-key","data"),
     Input("current-env","data"),
+    # no modo em lote o card já nasce preenchido por render_question_page
+    prevent_initial_call=QUESTIONS_BATCH_MODE,
 )
-
+@memoize_figures("update_question_graph")
 def update_question_graph(seg_col, seg_vals, qfilter, qdrill, fig_id, key, env_resolved):
     # 10 saídas SEMPRE
     main_fig   = go.Figure()
@@ -1937,25 +3548,24 @@ def update_question_graph(seg_col, seg_vals, qfilter, qdrill, fig_id, key, env_r
     try:
         key = key or os.getenv("KEY","")
         env_resolved = normalize_env(env_resolved or "dev")
-        df = load_df_for_key(env_resolved, key) if key else pd.DataFrame()
+        cube = load_cube_for_key(env_resolved, key) if key else None
 
-        if not fig_id or "qid" not in fig_id:
+        if not cube or not fig_id or "qid" not in fig_id:
             return (main_fig, fig_wrap_style, cat_fig, topics_fig, answers_fig,
                     {"display":"none"}, {"display":"none"}, {"display":"none"},
                     {"display":"none"}, sent_cards)
  
         qid = fig_id["qid"]
-        sub_all = df[df["question_id"] == qid].copy()
-        sub = sub_all.copy()
-
-        if seg_col and seg_vals and seg_col in sub.columns:
-            sub = sub[sub[seg_col].astype(str).isin([str(v) for v in seg_vals])]
-        sub = _apply_qfilter(sub, qfilter)
+        df = cube["df"]
+        qpos = question_positions(cube, qid)
+        # segmentação + filtro local (categoria/tópico) sobre posições; linhas só são materializadas se preciso
+        pos = select_rows(df, qpos, isin={seg_col: seg_vals} if seg_col else None,
+                          equals={k: (qfilter or {}).get(k) for k in ("category", "topic")})
 
         base_qtype = get_qtype_for_question_with_meta(
             env_resolved,
             qid,
-            sub_all["answer"] if "answer" in sub_all.columns else pd.Series(dtype=str),
+            df["answer"].take(qpos) if "answer" in df.columns else pd.Series(dtype=str),
             key
         )
 
@@ -1965,6 +3575,7 @@ def update_question_graph(seg_col, seg_vals, qfilter, qdrill, fig_id, key, env_r
         # --- LIKERT 1–5 (se houver)
         is_likert = (str(qid) in LIKERT_1_5_IDS) and (base_qtype in {"numeric","categorical","text"})
         if is_likert:
+            sub = take_rows(df, pos, QUESTION_CARD_COLS)
             vals = pd.to_numeric(sub["answer"], errors="coerce").round().clip(1,5).astype("Int64")
             d = sub.assign(val=vals).dropna(subset=["val"])
             cat_order = [1,2,3,4,5]
@@ -1977,82 +3588,37 @@ def update_question_graph(seg_col, seg_vals, qfilter, qdrill, fig_id, key, env_r
             main_fig.update_yaxes(showgrid=False, showticklabels=True)
 
             # cards só para abertas
-            sent_cards = render_sentiment_cards(sub) if (base_qtype in {"open-ended","text"}) else html.Div()
+            sent_cards = (render_sentiment_cards(None, sentiment_kpis(cube.get("sentiment"), pos))
+                          if (base_qtype in {"open-ended","text"}) else html.Div())
             clear_style = {"display":"inline-block","marginBottom":"12px"} if (qfilter and (qfilter.get("category") or qfilter.get("topic"))) else {"display":"none"}
 
             return (main_fig, fig_wrap_style, cat_fig, topics_fig, answers_fig,
                     cat_style, topics_style, answers_style, clear_style, sent_cards)
 
+        # Sem segmentação nem filtro local, o card sai dos agregados pré-calculados no load do CUBE
+        is_filtered = bool(seg_col and seg_vals and seg_col in df.columns) or \
+            bool(qfilter and (qfilter.get("category") or qfilter.get("topic")))
+        aggs = None if is_filtered else cube.get("qaggs", {}).get(str(qid))
+        if aggs is None or not _aggregates_cover(aggs, base_qtype):
+            aggs = question_aggregates(take_rows(df, pos, QUESTION_CARD_COLS), qtype=base_qtype,
+                                       sentiment=sentiment_kpis(cube.get("sentiment"), pos)
+                                       if base_qtype == "open-ended" else None)
+
         # --- NUMÉRICA
         if base_qtype == "numeric":
-            vals = pd.to_numeric(sub["answer"], errors="coerce")
-            main_fig = px.histogram(vals.dropna(), nbins=20, title="Distribuição")
-            main_fig = create_fig_style(main_fig, x="Valor", y="Frequência")
-            main_fig.update_xaxes(showgrid=False, showticklabels=True)
-            main_fig.update_yaxes(showgrid=False, showticklabels=True)
+            main_fig = numeric_hist_fig(aggs.get("hist"))
 
         # --- MÚLTIPLA
         elif base_qtype in ["multiple-choice", "multiple"]:
             sent_cards = html.Div()
-
-            exploded = explode_multiple(sub)
-            if not exploded.empty and "answer_item" in exploded.columns:
-                # limpeza sem reindex
-                exploded["answer_item"] = exploded["answer_item"].astype(str)
-                m = _non_empty_mask(exploded["answer_item"])
-                exploded = exploded[m].copy()
-
-                if not exploded.empty:
-                    vc = exploded["answer_item"].value_counts().head(20)
-                    df_bar = pd.DataFrame({"opcao": vc.index.astype(str), "qtde": vc.values})
-                    main_fig = px.bar(df_bar, x="opcao", y="qtde", title="Ocorrências por opção")
-                    main_fig.update_traces(text=df_bar["qtde"], textposition="outside", cliponaxis=False)
-                    main_fig = create_fig_style(main_fig, x="Opção", y="Qtde")
-                    main_fig = responsive_axis(main_fig, labels=df_bar["opcao"].tolist())
-                else:
-                    main_fig = make_minimal(go.Figure())
-            else:
-                main_fig = make_minimal(go.Figure())
-
-            main_fig.update_xaxes(showgrid=False, ticks="")
-            main_fig.update_yaxes(showgrid=False, ticks="", showticklabels=False)
+            main_fig = options_bar_fig(aggs.get("options"))
 
         # --- CATEGÓRICA
         elif base_qtype in ("single-choice", "categorical"):
             sent_cards = html.Div()
-
-            # Tenta na ordem: answer -> orig_answer -> option/choice -> category (fallback duro)
-            s, used_col = _first_nonempty_series(
-                sub, ["answer", "orig_answer", "option", "choice", "resposta", "category"]
-            )
-            print(f"[DEBUG] CATEGORICA qid={qid} fonte={used_col} n={len(s)}")
-
-            if not s.empty:
-                vc = s.value_counts()
-
-                # respeita opções do questionário, se existirem
-                meta = load_questionnaire_meta(env_resolved, key)
-                opts = (meta.get("options_map", {}) or {}).get(str(qid)) or []
-                if opts:
-                    order = [o for o in opts if o in vc.index]
-                    outros = [o for o in vc.index if o not in order]
-                    vc = vc.reindex(order + outros)
-
-                vc = vc.head(30)
-                df_bar = pd.DataFrame({"opcao": vc.index.astype(str), "qtde": vc.values})
-                main_fig = px.bar(
-                    df_bar, x="opcao", y="qtde",
-                    title="Ocorrências por opção",
-                    category_orders={"opcao": df_bar["opcao"].tolist()}
-                )
-                main_fig.update_traces(text=df_bar["qtde"], textposition="outside", cliponaxis=False)
-                main_fig = create_fig_style(main_fig, x="Opção", y="Qtde")
-                main_fig = responsive_axis(main_fig, labels=df_bar["opcao"].tolist())
-            else:
-                main_fig = make_minimal(go.Figure())
-
-            main_fig.update_xaxes(showgrid=False, ticks="")
-            main_fig.update_yaxes(showgrid=False, ticks="", showticklabels=False)
+            print(f"[DEBUG] CATEGORICA qid={qid} fonte={aggs.get('answers_col')} n={int(aggs['answers'].sum())}")
+            main_fig = options_bar_fig(aggs["answers"], options_order=opts, top_n=30,
+                                       category_orders=True)
 
         elif base_qtype == "open-ended":
             # esconder o gráfico principal
@@ -2060,20 +3626,11 @@ def update_question_graph(seg_col, seg_vals, qfilter, qdrill, fig_id, key, env_r
             main_fig = go.Figure()
 
             # cards de sentimento
-            sent_cards = render_sentiment_cards(sub) if not sub.empty else html.Div()
-
+            sent_cards = render_sentiment_cards(None, aggs["sentiment"]) if aggs["n"] else html.Div()
 
             # ---- NOVO: gráfico por CATEGORIA no lugar de "Intenção"
-            s_cat = sub["category"].dropna().astype(str).str.strip() if "category" in sub.columns else pd.Series([], dtype=str)
-            s_cat = s_cat[s_cat.ne("") & ~s_cat.str.lower().isin({"nan", "none", "null"})]
-
-            if not s_cat.empty:
-                vc = s_cat.value_counts().head(30)
-                df_bar = pd.DataFrame({"Categoria": vc.index.astype(str), "Qtde": vc.values})
-                cat_fig = px.bar(df_bar, x="Categoria", y="Qtde", title="Categorias – Distribuição")
-                cat_fig.update_traces(text=df_bar["Qtde"], textposition="outside", cliponaxis=False)
-                cat_fig = create_fig_style(cat_fig, x="Categoria", y="Qtde")
-                cat_fig = responsive_axis(cat_fig, labels=df_bar["Categoria"].tolist())
+            if not aggs["categories"].empty:
+                cat_fig = category_bar_fig(aggs["categories"])
                 cat_style = {"marginTop": "12px"}
             else:
                 cat_fig = go.Figure()
@@ -2085,23 +3642,23 @@ def update_question_graph(seg_col, seg_vals, qfilter, qdrill, fig_id, key, env_r
             answers_fig = go.Figure()
             answers_style = {"display": "none"}
 
-            # Botão "Limpar filtros" quando houver filtro local ou drill
-            has_local_filter = bool(qfilter and (qfilter.get("category") or qfilter.get("topic")))
-            has_drill = bool((qdrill or {}).get("level", 0) > 0)
-            clear_style = {"display": "inline-block", "marginBottom": "12px"} if (has_local_filter or has_drill) else {"display": "none"}
-
-            return (
-                main_fig,                     # q-fig
-                fig_wrap_style,               # q-fig-wrap style (escondido)
-                cat_fig,                      # q-catfig  (AGORA o gráfico principal p/ abertas)
-                topics_fig,                   # q-topicsfig
-                answers_fig,                  # q-answers
-                cat_style,                    # style catfig (mostrar/ocultar)
-                topics_style,                 # style topicsfig
-                answers_style,                # style answersfig
-                clear_style,                  # style botão limpar
-                sent_cards                    # cards de sentimento
-            )
+        # Botão "Limpar filtros" quando houver filtro local ou drill
+        has_local_filter = bool(qfilter and (qfilter.get("category") or qfilter.get("topic")))
+        has_drill = bool((qdrill or {}).get("level", 0) > 0)
+        clear_style = {"display": "inline-block", "marginBottom": "12px"} if (has_local_filter or has_drill) else {"display": "none"}
+
+        return (
+            main_fig,                     # q-fig
+            fig_wrap_style,               # q-fig-wrap style (escondido em abertas)
+            cat_fig,                      # q-catfig  (gráfico principal p/ abertas)
+            topics_fig,                   # q-topicsfig
+            answers_fig,                  # q-answers
+            cat_style,                    # style catfig (mostrar/ocultar)
+            topics_style,                 # style topicsfig
+            answers_style,                # style answersfig
+            clear_style,                  # style botão limpar
+            sent_cards                    # cards de sentimento
+        )
         
     except Exception as e:
         app.server.logger.exception("Erro no callback update_question_graph")
@@ -2111,9 +3668,19 @@ def update_question_graph(seg_col, seg_vals, qfilter, qdrill, fig_id, key, env_r
                 style_hide, style_hide, style_hide, {"display":"none"}, error_msg)
 
 
+def question_card_outputs(qid, key, env_resolved) -> tuple:
+    """Saídas de `update_question_graph` no estado inicial do card (sem segmentação, filtro ou drill).
+       Servidas dos agregados pré-calculados do CUBE e do FIGURE_CACHE."""
+    return update_question_graph(None, None, {"category": None, "topic": None},
+                                 {"level": 0, "seg_value": None, "category": None},
+                                 {"type": "q-fig", "qid": qid}, key, env_resolved)
+
+
 @dash.callback(
     Output({"type":"q-filterpill","qid":MATCH}, "children"),
-    Input({"type":"q-filter","qid":MATCH}, "data")
+    Input({"type":"q-filter","qid":MATCH}, "data"),
+    # sem filtro a pílula é vazia (estado inicial do card)
+    prevent_initial_call=QUESTIONS_BATCH_MODE,
 )
 def show_filter_pill(qfilter):
     if not qfilter:
@@ -2156,19 +3723,17 @@ def update_raw_table(filter_values, filter_ids, key, env_resolved):
         if df.empty:
             return html.Div("Sem dados.", className="alert alert-warning")
 
-        # aplica filtros
-        d = df.copy()
-        for col, sel in active_filters.items():
-            if col in d.columns:
-                d = d[d[col].astype(str).isin(sel)]
+        # aplica filtros (posições) e materializa só as 300 linhas exibidas
+        pos = select_rows(df, None, isin=active_filters)
+        pos = np.arange(min(len(df), 300)) if pos is None else pos[:300]
 
         # escolhe colunas seguras (sem PII)
-        cols_show = [c for c in d.columns if c not in {"orig_answer","survey_id"} and not is_pii(c)]
+        cols_show = [c for c in df.columns if c not in {"orig_answer","survey_id"} and not is_pii(c)]
         if "respondent_id" in cols_show:
             cols_show = ["respondent_id"] + [c for c in cols_show if c != "respondent_id"]
 
-        sample = d[cols_show].copy() if cols_show else d.head(0)
-        return dbc.Table.from_dataframe(sample.head(300), striped=True, bordered=True, hover=True, size="sm", responsive=True)
+        sample = take_rows(df, pos, cols_show) if cols_show else df.head(0)
+        return dbc.Table.from_dataframe(sample, striped=True, bordered=True, hover=True, size="sm", responsive=True)
     
     except Exception as e:
         app.server.logger.exception("Erro no callback update_raw_table")
@@ -2200,15 +3765,17 @@ def pivot_drill(clickData, rows, cols, pv_qid, pv_use_answer, pv_bins, ds, de, k
         key = key or os.getenv("KEY","")
         env_resolved = normalize_env(env_resolved or "dev")
 
-        df = load_df_for_key(env_resolved, key) if key else pd.DataFrame()
+        cube = load_cube_for_key(env_resolved, key) if key else None
+        df = cube["df"] if cube else pd.DataFrame()
         if not clickData or df.empty:
             return False, "", ""
-        d = df.copy()
+        rows = rows if isinstance(rows, list) else ([rows] if rows else [])
+        cols = cols if isinstance(cols, list) else ([cols] if cols else [])
+        show_cols = ["date_of_response","category","topic","sentiment","answer"]
 
-        if ds and de and "date_of_response" in d.columns:
-            d = d[(d["date_of_response"] >= ds) & (d["date_of_response"] <= de)]
+        pos = date_window_positions(cube, pv_qid, ds, de)
+        d = take_rows(df, pos, show_cols + rows + cols)
         if pv_qid:
-            d = d[d["question_id"].astype(str) == str(pv_qid)].copy()
             qtype = analyze_qtype(d["answer"]) if not d.empty else None
             wants_answer_dim = pv_use_answer and ("on" in (pv_use_answer or []))
             if wants_answer_dim and qtype != "text":
@@ -2218,32 +3785,28 @@ def pivot_drill(clickData, rows, cols, pv_qid, pv_use_answer, pv_bins, ds, de, k
                     bins = 10
                 d = make_pv_answer(d, bins=bins)
 
-        rows = rows if isinstance(rows, list) else ([rows] if rows else [])
-        cols = cols if isinstance(cols, list) else ([cols] if cols else [])
-
         pt = clickData["points"][0]
         custom = pt.get("customdata") or []
         xval = custom[0] if len(custom) >= 1 else pt.get("x")
         cval = custom[1] if len(custom) >= 2 else None
 
-        if rows:
-            dimx = rows[-1]
-            if dimx in d.columns:
-                d = d[d[dimx].astype(str) == str(xval)]
-        if cols:
-            dimc = cols[0]
-            if dimc in d.columns and cval is not None:
-                d = d[d[dimc].astype(str) == str(cval)]
+        # ponto clicado: máscaras combinadas, uma única seleção no fim
+        m = np.ones(len(d), dtype=bool)
+        if rows and rows[-1] in d.columns:
+            m &= str_isin_mask(d[rows[-1]], [str(xval)])
+        if cols and cols[0] in d.columns and cval is not None:
+            m &= str_isin_mask(d[cols[0]], [str(cval)])
+        if not m.all():
+            d = d[m]
 
-        state = build_state(df)
+        state = cube_state(cube, env_resolved, key)
         qdesc_map = state.get("QDESC_MAP", {})
         title = qdesc_map.get(str(pv_qid), "Respostas") if pv_qid else "Respostas"
         if d.empty:
             return True, f"Respostas – {title}", html.Div("Nenhum registro para este ponto.", className="text-muted")
 
-        show_cols = ["date_of_response","category","topic","sentiment","answer"]
         show_cols = [c for c in show_cols if c in d.columns]
-        tbl = d[show_cols].copy().sort_values("date_of_response", na_position="last")
+        tbl = d[show_cols].sort_values("date_of_response", na_position="last")
         if "date_of_response" in tbl.columns:
             tbl["date_of_response"] = pd.to_datetime(tbl["date_of_response"], errors="coerce").dt.strftime("%d/%m/%Y %H:%M")
 
@@ -0,0 +1,12 @@
+# Tarefas CPU-bound executadas no pool de processos do app (ver run_cpu_task em app.py).
+# Módulo mínimo de propósito: os processos filhos (spawn) importam só isto (wordcloud/PIL),
+# não o app inteiro (pandas, dash, plotly, boto3, pyarrow).
+import io
+
+from wordcloud import WordCloud, STOPWORDS
+
+
+def wordcloud_png(freq: dict, width: int, height: int) -> bytes:
+    wc = WordCloud(width=width, height=height, background_color="white", colormap="tab20c", prefer_horizontal=0.95, random_state=42, collocations=False, normalize_plurals=True, max_words=200, min_font_size=10, stopwords=STOPWORDS).generate_from_frequencies(freq)
+    buf = io.BytesIO(); wc.to_image().save(buf, format="PNG", optimize=True)
+    return buf.getvalue()
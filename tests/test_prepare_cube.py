@@ -0,0 +1,19 @@
+import pandas as pd
+
+import app
+
+
+def _baseline_answer(orig: pd.Series) -> pd.Series:
+    # normalização de orig_answer/answer do load original (por linha)
+    s = orig.astype(str).map(lambda x: x.strip() if isinstance(x, str) else x).replace({"nan": None, "None": None})
+    return s.astype(str).map(app.fix_mojibake)
+
+
+def test_answer_nulls_match_baseline():
+    orig = pd.Series([None, float("nan"), "", "  sim ", "nan", "None", "NÃ£o", "Pre√ßo", None], dtype=object)
+    df = pd.DataFrame({c: ["x"] * len(orig) for c in app.REQUIRED_COLS})
+    df["date_of_response"] = "2024-01-02 10:00:00"
+    df["orig_answer"] = orig
+    out = app._prepare_cube(df.copy())
+    assert out["answer"].tolist() == _baseline_answer(orig).tolist()
+    assert "nan" not in set(out["answer"])